@@ -2,16 +2,25 @@ import streamlit as st
 import streamlit.components.v1 as components
 import pandas as pd
 import os
+import re
+import threading
+import unicodedata
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-from campaigns.config import CAMPAIGNS, get_campaign_config, BRT
-from server.hotmart_client import HotmartClient
-from server.manychat_client import ManyChatClient
-from server.meta_ads_client import MetaAdsClient
-from server.google_sheet_client import GoogleSheetClient, ImersaoSheetClient, DesafioSheetClient
-from utils.data_processor import process_hotmart_sales, calculate_sales_metrics, process_sheets_data, group_sales_by_date
-from utils.chart_helpers import create_sales_line_chart, create_revenue_bar_chart, create_dark_theme_chart
+from campaigns.config import CAMPAIGNS, get_campaign_config, get_campaign_product_ids, get_campaign_status, BRT
+from server.hotmart_client import walk_stats
+from server.manychat_client import BF25_TAGS
+from server.registry import (
+    get_hotmart_client, get_manychat_client, get_meta_ads_client,
+    get_sheets_client, get_imersao_sheets_client, get_desafio_sheets_client, get_refresher
+)
+from server.cache import cache_stats, published_values, reset_stale_reads, stale_reads
+from server.http import breaker_states
+from server.snapshots import snapshot_store
+from server.singleflight import single_flight
+from utils.data_processor import process_hotmart_sales, calculate_sales_metrics, group_sales_by_date, frame_memory_report
+from utils.chart_helpers import create_sales_line_chart, create_revenue_bar_chart, create_dark_theme_chart, create_funnel_chart, create_meta_trend_chart
 
 st.set_page_config(
     page_title="Dashboard Multi-Campanhas | Escola de Automação e I.A",
@@ -483,6 +492,17 @@ INSTITUTIONAL_STYLES = f"""
         background: linear-gradient(135deg, {INSTITUTIONAL_ORANGE} 0%, {INSTITUTIONAL_ORANGE_LIGHT} 100%) !important;
     }}
     
+    div[data-testid="stButtonGroup"] button {{
+        background: rgba(255, 255, 255, 0.1);
+        border-radius: 12px;
+        color: white;
+        padding: 0.75rem 1.5rem;
+    }}
+    
+    div[data-testid="stButtonGroup"] button[data-testid="stBaseButton-segmented_controlActive"] {{
+        background: linear-gradient(135deg, {INSTITUTIONAL_ORANGE} 0%, {INSTITUTIONAL_ORANGE_LIGHT} 100%) !important;
+    }}
+    
     .stButton > button {{
         background: linear-gradient(135deg, {INSTITUTIONAL_ORANGE} 0%, {INSTITUTIONAL_ORANGE_LIGHT} 100%);
         color: white;
@@ -621,6 +641,17 @@ LIGHT_THEME_STYLES = f"""
         color: white !important;
     }}
     
+    div[data-testid="stButtonGroup"] button {{
+        background: #F1F5F9;
+        border-radius: 8px;
+        color: #4A5568;
+    }}
+    
+    div[data-testid="stButtonGroup"] button[data-testid="stBaseButton-segmented_controlActive"] {{
+        background: linear-gradient(135deg, {INSTITUTIONAL_ORANGE} 0%, {INSTITUTIONAL_ORANGE_LIGHT} 100%) !important;
+        color: white !important;
+    }}
+    
     .stButton > button {{
         background: linear-gradient(135deg, {INSTITUTIONAL_ORANGE} 0%, {INSTITUTIONAL_ORANGE_LIGHT} 100%);
         color: white;
@@ -657,17 +688,17 @@ def init_session_state():
     if 'selected_campaign' not in st.session_state:
         st.session_state.selected_campaign = None
     if 'hotmart_client' not in st.session_state:
-        st.session_state.hotmart_client = HotmartClient()
+        st.session_state.hotmart_client = get_hotmart_client()
     if 'manychat_client' not in st.session_state:
-        st.session_state.manychat_client = ManyChatClient()
+        st.session_state.manychat_client = get_manychat_client()
     if 'meta_ads_client' not in st.session_state:
-        st.session_state.meta_ads_client = MetaAdsClient()
+        st.session_state.meta_ads_client = get_meta_ads_client()
     if 'sheets_client' not in st.session_state:
-        st.session_state.sheets_client = GoogleSheetClient()
+        st.session_state.sheets_client = get_sheets_client()
     if 'imersao_sheets_client' not in st.session_state:
-        st.session_state.imersao_sheets_client = ImersaoSheetClient()
+        st.session_state.imersao_sheets_client = get_imersao_sheets_client()
     if 'desafio_sheets_client' not in st.session_state:
-        st.session_state.desafio_sheets_client = DesafioSheetClient()
+        st.session_state.desafio_sheets_client = get_desafio_sheets_client()
 
 def check_secrets_status():
     secrets = {
@@ -684,17 +715,170 @@ def check_secrets_status():
     }
     return secrets
 
+@st.cache_resource
+def get_sales_memory_registry() -> tuple:
+    # Shared by every session: (lock, {campaign_id: {dataset: row}}).
+    return threading.Lock(), {}
+
+def track_sales_memory(campaign_id: str, frames: dict):
+    report = frame_memory_report(frames)
+    lock, registry = get_sales_memory_registry()
+    with lock:
+        registry.setdefault(campaign_id, {}).update(
+            {row['dataset']: row for row in report.to_dict('records')}
+        )
+
+def render_sales_memory(campaign_id: str):
+    lock, registry = get_sales_memory_registry()
+    with lock:
+        datasets = list(registry.get(campaign_id, {}).values())
+    if not datasets:
+        return
+    
+    with st.sidebar:
+        st.markdown("### Memória das Vendas")
+        df = pd.DataFrame(datasets)
+        st.dataframe(
+            df.assign(MB=(df['bytes'] / 1024 ** 2).round(2)).drop(columns='bytes'),
+            hide_index=True,
+            use_container_width=True
+        )
+        st.caption(f"Total neste processo: {df['bytes'].sum() / 1024 ** 2:.2f} MB")
+
+def render_cache_stats():
+    stats = cache_stats.snapshot()
+    
+    with st.sidebar:
+        st.markdown("### Cache das Integrações")
+        if not stats:
+            st.caption("Nenhuma consulta registrada neste processo.")
+            return
+        
+        rows = [
+            {
+                'Consulta': namespace,
+                'Hits': values['hits'],
+                'Misses': values['misses'],
+                'Taxa de Acerto': f"{values['hit_rate'] * 100:.0f}%"
+            }
+            for namespace, values in stats.items()
+        ]
+        st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+        
+        walk = walk_stats.snapshot()
+        if walk['requests']:
+            st.caption(
+                f"Hotmart: {walk['requests']:,} requisições de histórico "
+                f"({walk['saved']:,} a menos que a varredura diária fixa)"
+            )
+        
+        flights = single_flight.snapshot()
+        absorbed = {namespace: values['absorbed'] for namespace, values in flights.items() if values['absorbed']}
+        if absorbed:
+            details = ', '.join(f"{namespace}: {count:,}" for namespace, count in absorbed.items())
+            st.caption(
+                f"{sum(absorbed.values()):,} chamadas duplicadas aproveitaram uma requisição "
+                f"já em andamento ({details})"
+            )
+        
+        open_breakers = [
+            INTEGRATION_NAMES.get(name, name) for name, state in breaker_states().items() if state != 'closed'
+        ]
+        if open_breakers:
+            st.caption(f"Circuito aberto (falhas consecutivas): {', '.join(open_breakers)}")
+        
+        frozen = snapshot_store.manifests()
+        if frozen:
+            details = ', '.join(
+                f"{manifest['metadata'].get('name', campaign_id)} "
+                f"({datetime.fromtimestamp(manifest['frozen_at'], BRT).strftime('%d/%m/%Y')})"
+                for campaign_id, manifest in frozen.items()
+            )
+            st.caption(f"Campanhas congeladas, sem chamadas às APIs: {details}")
+        
+        published = published_values.snapshot()
+        if published:
+            now = datetime.now().timestamp()
+            details = ', '.join(
+                f"{namespace}: {values['series']} ({(now - values['oldest']) / 60:.0f} min)"
+                for namespace, values in published.items()
+            )
+            st.caption(f"Atualizado em segundo plano: {details}")
+
+INTEGRATION_NAMES = {
+    'hotmart': 'Hotmart',
+    'meta_ads': 'Meta Ads',
+    'manychat': 'ManyChat',
+    'google_sheets': 'Google Sheets'
+}
+
+def render_stale_badge(placeholder):
+    # Filled after the dashboard ran, so it lists every source served stale.
+    reads = stale_reads()
+    if not reads:
+        return
+    
+    now = datetime.now().timestamp()
+    sources = {}
+    for namespace, read in reads.items():
+        name = INTEGRATION_NAMES.get(namespace.split('.')[0], namespace)
+        current = sources.get(name)
+        if current is None or read['saved_at'] < current['saved_at']:
+            sources[name] = {'saved_at': read['saved_at'], 'error': read['error'] or (current or {}).get('error')}
+        elif read['error']:
+            current['error'] = read['error']
+    
+    details = ', '.join(
+        f"{name} de {(now - source['saved_at']) / 60:.0f} min atrás"
+        for name, source in sorted(sources.items())
+    )
+    if any(source['error'] for source in sources.values()):
+        placeholder.warning(f"⚠️ API indisponível, exibindo os últimos dados válidos: {details}")
+    else:
+        placeholder.caption(f"🔄 Atualizando em segundo plano; exibindo dados {details}")
+
+def render_sheet_table(client, sheet_name: str, key: str):
+    # KPI cards come from row counts; the sheet itself is only downloaded
+    # once the viewer asks for the table.
+    if st.toggle("Mostrar tabela completa", key=key):
+        st.dataframe(client.get_sheet_frame(sheet_name), use_container_width=True)
+
 def format_currency(value):
     return f"R$ {value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
-def get_campaign_status(campaign):
-    now = datetime.now(BRT)
-    if now < campaign['period_start']:
-        return "upcoming", "Em breve"
-    elif now > campaign['period_end']:
-        return "ended", "Encerrada"
-    else:
-        return "active", "Ativa"
+def tab_slug(tab_name: str) -> str:
+    ascii_name = unicodedata.normalize('NFKD', tab_name).encode('ascii', 'ignore').decode()
+    return re.sub(r'[^a-z0-9]+', '-', ascii_name.lower()).strip('-')
+
+def requested_tab(tab_names: list, slugs: list) -> str:
+    requested = st.query_params.get('tab')
+    return tab_names[slugs.index(requested)] if requested in slugs else tab_names[0]
+
+def keep_active_tab(key: str, tab_names: list, slugs: list):
+    # Clicking the active option deselects it; select the last tab again so
+    # the control and the content stay in sync.
+    if st.session_state[key] is None:
+        st.session_state[key] = requested_tab(tab_names, slugs)
+
+def render_lazy_tabs(campaign_id: str, tab_names: list, renderers: list):
+    # st.tabs runs every tab body on each rerun; this only runs the active one,
+    # so a dashboard costs one tab's worth of upstream calls.
+    slugs = [tab_slug(name) for name in tab_names]
+    key = f"active_tab_{campaign_id}"
+    
+    if st.session_state.get(key) is None:
+        st.session_state[key] = requested_tab(tab_names, slugs)
+    
+    selected = st.segmented_control(
+        "Abas", tab_names, key=key, label_visibility="collapsed",
+        on_change=keep_active_tab, args=(key, tab_names, slugs)
+    )
+    
+    index = tab_names.index(selected)
+    st.query_params['campaign'] = campaign_id
+    st.query_params['tab'] = slugs[index]
+    
+    renderers[index]()
 
 def render_campaign_selector():
     st.markdown(SELECTOR_STYLES, unsafe_allow_html=True)
@@ -1093,40 +1277,19 @@ def render_bf25_dashboard():
         </div>
     """, unsafe_allow_html=True)
     
-    tabs = st.tabs(config['tabs'])
-    
-    with tabs[0]:
-        render_bf25_captacao(secrets)
-    
-    with tabs[1]:
-        render_bf25_vendas(config, secrets)
-    
-    with tabs[2]:
-        render_bf25_comparar(config, secrets)
-    
-    with tabs[3]:
-        render_bf25_origem_leads(secrets)
-    
-    with tabs[4]:
-        render_bf25_pesquisa(secrets)
-    
-    with tabs[5]:
-        render_bf25_investimentos()
-    
-    with tabs[6]:
-        render_bf25_meta_ads(config, secrets)
-    
-    with tabs[7]:
-        render_bf25_zapzap(secrets)
-    
-    with tabs[8]:
-        render_bf25_dados(config, secrets)
-    
-    with tabs[9]:
-        render_bf25_metas(config)
-    
-    with tabs[10]:
-        render_bf25_planejamento()
+    render_lazy_tabs('bf25', config['tabs'], [
+        lambda: render_bf25_captacao(secrets),
+        lambda: render_bf25_vendas(config, secrets),
+        lambda: render_bf25_comparar(config, secrets),
+        lambda: render_bf25_origem_leads(secrets),
+        lambda: render_bf25_pesquisa(secrets),
+        lambda: render_bf25_investimentos(),
+        lambda: render_bf25_meta_ads(config, secrets),
+        lambda: render_bf25_zapzap(secrets),
+        lambda: render_bf25_dados(config, secrets),
+        lambda: render_bf25_metas(config),
+        lambda: render_bf25_planejamento()
+    ])
 
 def render_bf25_captacao(secrets):
     st.subheader("Visão da Captação")
@@ -1134,11 +1297,8 @@ def render_bf25_captacao(secrets):
     if secrets.get('GOOGLE_SPREADSHEET_ID_BF25') or secrets.get('GOOGLE_SPREADSHEET_ID'):
         try:
             client = st.session_state.sheets_client
-            leads_alunos = client.get_leads_alunos()
-            leads_geral = client.get_leads_geral()
-            
-            total_alunos = len(leads_alunos) - 1 if len(leads_alunos) > 1 else 0
-            total_geral = len(leads_geral) - 1 if len(leads_geral) > 1 else 0
+            total_alunos = client.get_row_count('Leads [EA Alunos]')
+            total_geral = client.get_row_count('Leads [Geral]')
             total_leads = total_alunos + total_geral
             
             col1, col2, col3, col4 = st.columns(4)
@@ -1195,7 +1355,8 @@ def render_bf25_vendas(config, secrets):
                 sales = client.get_approved_sales(product_id, start_date, end_date)
                 refunds = client.get_refunded_sales(product_id, start_date, end_date)
             
-            df_sales = process_hotmart_sales(sales)
+            df_sales = process_hotmart_sales(sales, include_buyer=False)
+            track_sales_memory('bf25', {'vendas': df_sales})
             metrics = calculate_sales_metrics(df_sales)
             
             col1, col2, col3, col4 = st.columns(4)
@@ -1257,11 +1418,8 @@ def render_bf25_pesquisa(secrets):
     if secrets.get('GOOGLE_SPREADSHEET_ID_BF25') or secrets.get('GOOGLE_SPREADSHEET_ID'):
         try:
             client = st.session_state.sheets_client
-            pesquisa_alunos = client.get_pesquisa_alunos()
-            pesquisa_geral = client.get_pesquisa_geral()
-            
-            total_alunos = len(pesquisa_alunos) - 1 if len(pesquisa_alunos) > 1 else 0
-            total_geral = len(pesquisa_geral) - 1 if len(pesquisa_geral) > 1 else 0
+            total_alunos = client.get_row_count('Pesquisa [EA Alunos]')
+            total_geral = client.get_row_count('Pesquisa [Geral]')
             
             col1, col2, col3 = st.columns(3)
             with col1:
@@ -1315,6 +1473,8 @@ def render_bf25_meta_ads(config, secrets):
                 st.metric("CTR", f"{ctr:.2f}%")
             with col4:
                 st.metric("Gasto", format_currency(spend))
+            
+            render_meta_trend(client.get_daily_insights(start_date, end_date, 'BF25'))
         except Exception as e:
             st.warning(f"Erro ao carregar Meta Ads: {e}")
     else:
@@ -1330,6 +1490,14 @@ def render_bf25_meta_ads(config, secrets):
         
         st.info("Configure o META_ACCESS_TOKEN e META_AD_ACCOUNT_ID nos Secrets.")
 
+def render_meta_trend(days: list, dark: bool = False):
+    # Drawn from the same daily rows the totals above are summed from.
+    if days:
+        fig = create_meta_trend_chart(pd.DataFrame(days))
+        if dark:
+            fig = create_dark_theme_chart(fig)
+        st.plotly_chart(fig, use_container_width=True)
+
 def render_bf25_zapzap(secrets):
     st.subheader("API Oficial do ZapZap (ManyChat)")
     
@@ -1355,11 +1523,42 @@ def render_bf25_zapzap(secrets):
                 st.metric("Boas-vindas Clicou", f"{metrics.get('geral_boas_vindas_clicou', 0):,}")
             with col3:
                 st.metric("Fluxo Instagram", f"{metrics.get('geral_fluxo_instagram', 0):,}")
+            
+            render_bf25_funnels(client)
         except Exception as e:
             st.warning(f"Erro ao carregar ManyChat: {e}")
     else:
         st.info("Configure o MANYCHAT_API_TOKEN nos Secrets para visualizar as métricas.")
 
+FUNNEL_STEP_LABELS = {
+    BF25_TAGS['alunos_boas_vindas_recebeu']: 'Boas-vindas Recebeu',
+    BF25_TAGS['alunos_boas_vindas_clicou']: 'Boas-vindas Clicou',
+    BF25_TAGS['geral_boas_vindas_recebeu']: 'Boas-vindas Recebeu',
+    BF25_TAGS['geral_boas_vindas_clicou']: 'Boas-vindas Clicou',
+    BF25_TAGS['geral_clicou_link_lp']: 'Clicou Link LP',
+    BF25_TAGS['geral_deixou_telefone']: 'Deixou Telefone'
+}
+
+def render_bf25_funnels(client):
+    # Each step counts subscribers who also went through every step before it.
+    st.markdown("### Funil de Conversão")
+    
+    with st.spinner("Cruzando contatos do ManyChat..."):
+        funnels = client.get_bf25_funnels()
+    
+    col1, col2 = st.columns(2)
+    for col, (name, title) in zip((col1, col2), (('alunos', 'Alunos EA'), ('geral', 'Público Geral'))):
+        steps = funnels[name]
+        fig = create_funnel_chart(
+            [FUNNEL_STEP_LABELS.get(step['tag'], step['tag']) for step in steps],
+            [step['reached'] for step in steps],
+            title
+        )
+        with col:
+            st.plotly_chart(fig, use_container_width=True)
+    
+    st.metric("Público Geral: receberam e não clicaram", f"{funnels['geral_sem_clique']:,}")
+
 def render_bf25_dados(config, secrets):
     st.subheader("Dados Brutos")
     
@@ -1372,6 +1571,7 @@ def render_bf25_dados(config, secrets):
             
             sales = client.get_approved_sales(product_id, start_date, end_date)
             df = process_hotmart_sales(sales)
+            track_sales_memory('bf25', {'dados': df})
             
             if not df.empty:
                 st.dataframe(df, use_container_width=True)
@@ -1454,19 +1654,12 @@ def render_imersao_dashboard():
         </div>
     """, unsafe_allow_html=True)
     
-    tabs = st.tabs(config['tabs'])
-    
-    with tabs[0]:
-        render_imersao_vendas(config, secrets)
-    
-    with tabs[1]:
-        render_imersao_reembolsos(config, secrets)
-    
-    with tabs[2]:
-        render_imersao_pesquisa_tab()
-    
-    with tabs[3]:
-        render_imersao_monitoramento()
+    render_lazy_tabs('imersao0126', config['tabs'], [
+        lambda: render_imersao_vendas(config, secrets),
+        lambda: render_imersao_reembolsos(config, secrets),
+        lambda: render_imersao_pesquisa_tab(),
+        lambda: render_imersao_monitoramento()
+    ])
 
 def render_imersao_vendas(config, secrets):
     st.subheader("Vendas")
@@ -1480,11 +1673,15 @@ def render_imersao_vendas(config, secrets):
             end_date = min(config['period_end'], datetime.now(BRT))
             
             with st.spinner("Carregando vendas da Hotmart..."):
-                ingressos = client.get_approved_sales(ingresso_id, start_date, end_date)
-                orderbumps = client.get_approved_sales(orderbump_id, start_date, end_date)
+                sales_by_product = client.get_approved_sales_by_product(
+                    get_campaign_product_ids('imersao0126'), start_date, end_date
+                )
+                ingressos = sales_by_product[ingresso_id]
+                orderbumps = sales_by_product[orderbump_id]
             
-            df_ingressos = process_hotmart_sales(ingressos)
-            df_orderbumps = process_hotmart_sales(orderbumps)
+            df_ingressos = process_hotmart_sales(ingressos, include_buyer=False)
+            df_orderbumps = process_hotmart_sales(orderbumps, include_buyer=False)
+            track_sales_memory('imersao0126', {'ingressos': df_ingressos, 'orderbumps': df_orderbumps})
             
             metrics_ing = calculate_sales_metrics(df_ingressos)
             metrics_ord = calculate_sales_metrics(df_orderbumps)
@@ -1583,9 +1780,13 @@ def render_imersao_reembolsos(config, secrets):
             end_date = min(config['period_end'], datetime.now(BRT))
             
             with st.spinner("Carregando reembolsos..."):
-                refunds = client.get_refunded_sales(ingresso_id, start_date, end_date)
+                refunds_by_product = client.get_refunded_sales_by_product(
+                    get_campaign_product_ids('imersao0126'), start_date, end_date
+                )
+                refunds = refunds_by_product[ingresso_id]
             
-            df_refunds = process_hotmart_sales(refunds)
+            df_refunds = process_hotmart_sales(refunds, include_buyer=False)
+            track_sales_memory('imersao0126', {'reembolsos': df_refunds})
             metrics = calculate_sales_metrics(df_refunds)
             
             col1, col2, col3 = st.columns(3)
@@ -1649,9 +1850,7 @@ def render_imersao_pesquisa_tab():
     
     try:
         client = st.session_state.imersao_sheets_client
-        pesquisa = client.get_pesquisa()
-        
-        total = len(pesquisa) - 1 if len(pesquisa) > 1 else 0
+        total = client.get_row_count('PESQUISA')
         
         st.markdown(f"""
             <div class="glass-card">
@@ -1661,8 +1860,7 @@ def render_imersao_pesquisa_tab():
         """, unsafe_allow_html=True)
         
         if total > 0:
-            df = process_sheets_data(pesquisa)
-            st.dataframe(df, use_container_width=True)
+            render_sheet_table(client, 'PESQUISA', 'imersao_pesquisa_table')
     except Exception as e:
         st.info("Dados da pesquisa serão exibidos quando disponíveis.")
 
@@ -1671,9 +1869,7 @@ def render_imersao_monitoramento():
     
     try:
         client = st.session_state.imersao_sheets_client
-        grupos = client.get_monitoramento_grupos()
-        
-        total = len(grupos) - 1 if len(grupos) > 1 else 0
+        total = client.get_row_count('MONITORAMENTO GRUPOS')
         
         st.markdown(f"""
             <div class="glass-card">
@@ -1683,8 +1879,7 @@ def render_imersao_monitoramento():
         """, unsafe_allow_html=True)
         
         if total > 0:
-            df = process_sheets_data(grupos)
-            st.dataframe(df, use_container_width=True)
+            render_sheet_table(client, 'MONITORAMENTO GRUPOS', 'imersao_monitoramento_table')
     except Exception as e:
         st.info("Dados de monitoramento serão exibidos quando disponíveis.")
 
@@ -1718,22 +1913,13 @@ def render_desafio_dashboard():
         </div>
     """, unsafe_allow_html=True)
 
-    tabs = st.tabs(config['tabs'])
-
-    with tabs[0]:
-        render_desafio_captacao(config, secrets)
-
-    with tabs[1]:
-        render_desafio_pesquisa(secrets)
-
-    with tabs[2]:
-        render_desafio_grupos(secrets)
-
-    with tabs[3]:
-        render_desafio_origem_leads(secrets)
-
-    with tabs[4]:
-        render_desafio_meta_ads(config, secrets)
+    render_lazy_tabs('desafio0326', config['tabs'], [
+        lambda: render_desafio_captacao(config, secrets),
+        lambda: render_desafio_pesquisa(secrets),
+        lambda: render_desafio_grupos(secrets),
+        lambda: render_desafio_origem_leads(secrets),
+        lambda: render_desafio_meta_ads(config, secrets)
+    ])
 
 
 def render_desafio_captacao(config, secrets):
@@ -1758,13 +1944,21 @@ def render_desafio_captacao(config, secrets):
             end_date = min(config['period_end'], datetime.now(BRT))
 
             with st.spinner("Carregando vendas da Hotmart..."):
-                sales_principal = client.get_approved_sales(config['hotmart']['principal']['product_id'], start_date, end_date)
-                sales_vip = client.get_approved_sales(config['hotmart']['orderbump_vip']['product_id'], start_date, end_date)
-                sales_ea = client.get_approved_sales(config['hotmart']['escola_automacao']['product_id'], start_date, end_date)
-
-            df_principal = process_hotmart_sales(sales_principal)
-            df_vip = process_hotmart_sales(sales_vip)
-            df_ea = process_hotmart_sales(sales_ea)
+                sales_by_product = client.get_approved_sales_by_product(
+                    get_campaign_product_ids('desafio0326'), start_date, end_date
+                )
+                sales_principal = sales_by_product[config['hotmart']['principal']['product_id']]
+                sales_vip = sales_by_product[config['hotmart']['orderbump_vip']['product_id']]
+                sales_ea = sales_by_product[config['hotmart']['escola_automacao']['product_id']]
+
+            df_principal = process_hotmart_sales(sales_principal, include_buyer=False)
+            df_vip = process_hotmart_sales(sales_vip, include_buyer=False)
+            df_ea = process_hotmart_sales(sales_ea, include_buyer=False)
+            track_sales_memory('desafio0326', {
+                'principal': df_principal,
+                'orderbump_vip': df_vip,
+                'escola_automacao': df_ea
+            })
 
             m_principal = calculate_sales_metrics(df_principal)
             m_vip = calculate_sales_metrics(df_vip)
@@ -1783,8 +1977,7 @@ def render_desafio_captacao(config, secrets):
     if has_sheets:
         try:
             client = st.session_state.desafio_sheets_client
-            leads = client.get_leads()
-            total_leads = len(leads) - 1 if len(leads) > 1 else 0
+            total_leads = client.get_row_count('LEADS')
         except Exception as e:
             st.warning(f"Erro ao carregar leads: {e}")
 
@@ -1868,9 +2061,7 @@ def render_desafio_pesquisa(secrets):
     if secrets.get('GOOGLE_SPREADSHEET_ID_DESAFIO0326'):
         try:
             client = st.session_state.desafio_sheets_client
-            pesquisa = client.get_pesquisa()
-
-            total = len(pesquisa) - 1 if len(pesquisa) > 1 else 0
+            total = client.get_row_count('PESQUISA')
 
             st.markdown(f"""
                 <div class="glass-card">
@@ -1880,8 +2071,7 @@ def render_desafio_pesquisa(secrets):
             """, unsafe_allow_html=True)
 
             if total > 0:
-                df = process_sheets_data(pesquisa)
-                st.dataframe(df, use_container_width=True)
+                render_sheet_table(client, 'PESQUISA', 'desafio_pesquisa_table')
         except Exception as e:
             st.warning(f"Erro ao carregar pesquisa: {e}")
     else:
@@ -1900,9 +2090,7 @@ def render_desafio_grupos(secrets):
     if secrets.get('GOOGLE_SPREADSHEET_ID_DESAFIO0326'):
         try:
             client = st.session_state.desafio_sheets_client
-            grupos = client.get_grupos()
-
-            total = len(grupos) - 1 if len(grupos) > 1 else 0
+            total = client.get_row_count('GRUPOS')
 
             st.markdown(f"""
                 <div class="glass-card">
@@ -1912,8 +2100,7 @@ def render_desafio_grupos(secrets):
             """, unsafe_allow_html=True)
 
             if total > 0:
-                df = process_sheets_data(grupos)
-                st.dataframe(df, use_container_width=True)
+                render_sheet_table(client, 'GRUPOS', 'desafio_grupos_table')
         except Exception as e:
             st.warning(f"Erro ao carregar grupos: {e}")
     else:
@@ -1932,9 +2119,9 @@ def render_desafio_origem_leads(secrets):
     if secrets.get('GOOGLE_SPREADSHEET_ID_DESAFIO0326'):
         try:
             client = st.session_state.desafio_sheets_client
-            origem = client.get_origem_leads()
+            df = client.get_sheet_frame('ORIGEM DOS LEADS')
 
-            total = len(origem) - 1 if len(origem) > 1 else 0
+            total = len(df)
 
             st.markdown(f"""
                 <div class="glass-card">
@@ -1944,7 +2131,6 @@ def render_desafio_origem_leads(secrets):
             """, unsafe_allow_html=True)
 
             if total > 0:
-                df = process_sheets_data(origem)
                 st.dataframe(df, use_container_width=True)
 
                 if 'origem' in [c.lower() for c in df.columns] or 'Origem' in df.columns:
@@ -2031,6 +2217,8 @@ def render_desafio_meta_ads(config, secrets):
                         <div class="metric-value">{format_currency(spend)}</div>
                     </div>
                 """, unsafe_allow_html=True)
+
+            render_meta_trend(client.get_desafio0326_daily(start_date, end_date), dark=True)
         except Exception as e:
             st.warning(f"Erro ao carregar Meta Ads: {e}")
     else:
@@ -2049,7 +2237,10 @@ def render_desafio_meta_ads(config, secrets):
 
 
 def main():
+    get_refresher()
     init_session_state()
+    reset_stale_reads()
+    stale_badge = st.empty()
 
     if st.session_state.selected_campaign is None:
         render_campaign_selector()
@@ -2059,6 +2250,11 @@ def main():
         render_imersao_dashboard()
     elif st.session_state.selected_campaign == 'desafio0326':
         render_desafio_dashboard()
+    
+    render_stale_badge(stale_badge)
+    render_cache_stats()
+    if st.session_state.selected_campaign:
+        render_sales_memory(st.session_state.selected_campaign)
 
 if __name__ == "__main__":
     main()
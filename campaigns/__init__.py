@@ -1 +1 @@
-from .config import CAMPAIGNS, get_campaign_config
+from .config import CAMPAIGNS, get_campaign_config, get_campaign_product_ids, get_campaign_status
@@ -122,3 +122,18 @@ CAMPAIGNS = {
 
 def get_campaign_config(campaign_id: str) -> dict:
     return CAMPAIGNS.get(campaign_id, {})
+
+def get_campaign_status(campaign):
+    now = datetime.now(BRT)
+    if now < campaign['period_start']:
+        return "upcoming", "Em breve"
+    elif now > campaign['period_end']:
+        return "ended", "Encerrada"
+    else:
+        return "active", "Ativa"
+
+def get_campaign_product_ids(campaign_id: str) -> list:
+    hotmart = get_campaign_config(campaign_id).get('hotmart', {})
+    if 'product_id' in hotmart:
+        return [hotmart['product_id']]
+    return [product['product_id'] for product in hotmart.values()]
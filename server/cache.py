@@ -0,0 +1,269 @@
+import contextlib
+import functools
+import os
+import pickle
+import threading
+import time
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import streamlit as st
+
+from server.http import UpstreamError
+from server.snapshots import snapshot_store
+
+BRT = ZoneInfo('America/Sao_Paulo')
+
+# Open-ended ranges (end == "now") are snapped down to this bucket so that
+# every rerun inside the same bucket produces the same cache key.
+REFRESH_BUCKET_SECONDS = int(os.environ.get('CACHE_REFRESH_BUCKET_SECONDS', '300'))
+# Expired entries younger than this are served at once while a background
+# thread revalidates them; older ones make the viewer wait for fresh data.
+CACHE_MAX_STALE_SECONDS = int(os.environ.get('CACHE_MAX_STALE_SECONDS', '3600'))
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def _bump(self, namespace: str, field: str):
+        with self._lock:
+            counters = self._counters.setdefault(namespace, {'calls': 0, 'misses': 0})
+            counters[field] += 1
+
+    def record_call(self, namespace: str):
+        self._bump(namespace, 'calls')
+
+    def record_miss(self, namespace: str):
+        self._bump(namespace, 'misses')
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = {namespace: dict(values) for namespace, values in self._counters.items()}
+
+        result = {}
+        for namespace, values in sorted(counters.items()):
+            hits = max(values['calls'] - values['misses'], 0)
+            result[namespace] = {
+                'hits': hits,
+                'misses': values['misses'],
+                'hit_rate': hits / values['calls'] if values['calls'] else 0
+            }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+cache_stats = CacheStats()
+
+
+class PublishedValues:
+    # Process-wide values pushed by the background refresher. Entries are
+    # pickled like st.cache_data entries so every reader gets its own copy.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def publish(self, namespace: str, key: tuple, value, max_age: int = None):
+        now = time.time()
+        entry = (pickle.dumps(value), now, now + max_age if max_age is not None else float('inf'))
+        with self._lock:
+            self._entries[(namespace, key)] = entry
+
+    def get(self, namespace: str, key: tuple) -> tuple:
+        # (found, value, published_at)
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+        if entry is None or entry[2] < time.time():
+            return False, None, None
+        return True, pickle.loads(entry[0]), entry[1]
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        with self._lock:
+            entries = list(self._entries.items())
+
+        result = {}
+        for (namespace, _), (_, published_at, expires_at) in entries:
+            if expires_at < now:
+                continue
+            stats = result.setdefault(namespace, {'series': 0, 'oldest': published_at})
+            stats['series'] += 1
+            stats['oldest'] = min(stats['oldest'], published_at)
+        return dict(sorted(result.items()))
+
+
+published_values = PublishedValues()
+# Last successful result per key, kept without expiry so an upstream outage
+# degrades to old data instead of an error or an empty dashboard.
+last_known_good = PublishedValues()
+
+_refresh_context = threading.local()
+_stale_context = threading.local()
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+
+def reset_stale_reads():
+    _stale_context.reads = {}
+
+
+def stale_reads() -> dict:
+    # {namespace: {'saved_at', 'error'}} served stale in this script run.
+    return dict(getattr(_stale_context, 'reads', {}))
+
+
+def _record_stale_read(namespace: str, saved_at: float, error: str = None):
+    reads = getattr(_stale_context, 'reads', None)
+    if reads is None:
+        reads = _stale_context.reads = {}
+    current = reads.get(namespace)
+    if current is None or saved_at < current['saved_at']:
+        reads[namespace] = {'saved_at': saved_at, 'error': error or (current or {}).get('error')}
+    elif error:
+        current['error'] = error
+
+
+def _revalidate(namespace: str, key: tuple, cached_func, args: tuple, kwargs: dict):
+    with _revalidating_lock:
+        if (namespace, key) in _revalidating:
+            return
+        _revalidating.add((namespace, key))
+
+    def run():
+        try:
+            cached_func(*args, **kwargs)
+        except Exception:
+            pass
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard((namespace, key))
+
+    threading.Thread(target=run, name=f'revalidate-{namespace}', daemon=True).start()
+
+
+@contextlib.contextmanager
+def refreshing(max_age: int = None):
+    # Inside this block cached functions bypass every cache and compute once
+    # per key. Results are published for max_age seconds (when given) and
+    # collected in the yielded {(namespace, key): value} dict.
+    _refresh_context.cycle = {}
+    _refresh_context.max_age = max_age
+    try:
+        yield _refresh_context.cycle
+    finally:
+        _refresh_context.cycle = None
+
+
+def _series_value(value):
+    # A range that ends "now" is the same series whenever it is computed, so
+    # the refresher and the viewers agree on its key.
+    if isinstance(value, datetime):
+        now = datetime.now(value.tzinfo)
+        if now - timedelta(seconds=REFRESH_BUCKET_SECONDS) <= value <= now:
+            return 'open'
+    elif isinstance(value, date) and value == datetime.now(BRT).date():
+        return 'open'
+    elif isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def series_key(args: tuple, kwargs: dict) -> tuple:
+    # args[0] is the client; there is one per class for the whole process,
+    # and the class name stays the same across restarts (frozen snapshots).
+    values = [type(args[0]).__name__] if args else []
+    values.extend(_series_value(value) for value in args[1:])
+    values.extend((name, _series_value(value)) for name, value in sorted(kwargs.items()))
+    return tuple(values)
+
+
+def cached(namespace: str, ttl: int = 300, max_entries: int = None, publish: bool = True,
+           versioned: bool = False, stale: bool = True):
+    # ttl=None keeps entries until evicted by max_entries. publish=False keeps
+    # the background refresher from publishing results (short-lived probes).
+    # stale=False never serves an expired entry while revalidating, and an
+    # outage fallback is not reported as stale (change probes: an old token
+    # only means the data keyed by it is served a little longer).
+    # versioned: the last positional argument is a change token; entries are
+    # keyed by it, while the last-known-good copy is kept once per series.
+    def good_key(args: tuple, kwargs: dict) -> tuple:
+        return series_key(args[:-1] if versioned else args, kwargs)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def compute(*args, **kwargs):
+            # Only runs when st.cache_data has no entry for the key. Upstream
+            # errors propagate, so st.cache_data never stores a failure.
+            cache_stats.record_miss(namespace)
+            value = func(*args, **kwargs)
+            last_known_good.publish(namespace, good_key(args, kwargs), value)
+            return value
+
+        cached_func = st.cache_data(ttl=ttl, max_entries=max_entries, show_spinner=False)(compute)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = series_key(args, kwargs)
+
+            # Ended campaigns are served from their frozen bundle, without
+            # touching any API or cache.
+            found, value = snapshot_store.get(namespace, key)
+            if found:
+                if getattr(_refresh_context, 'cycle', None) is None:
+                    cache_stats.record_call(namespace)
+                return value
+
+            cycle = getattr(_refresh_context, 'cycle', None)
+            if cycle is not None:
+                if (namespace, key) not in cycle:
+                    # A versioned entry is valid for as long as its token is,
+                    # so the refresher reuses it instead of pulling it again.
+                    cycle[(namespace, key)] = (cached_func if versioned else func)(*args, **kwargs)
+                    if publish and _refresh_context.max_age is not None:
+                        published_values.publish(namespace, key, cycle[(namespace, key)], _refresh_context.max_age)
+                    last_known_good.publish(namespace, good_key(args, kwargs), cycle[(namespace, key)])
+                return cycle[(namespace, key)]
+
+            cache_stats.record_call(namespace)
+            found, value, _ = published_values.get(namespace, key)
+            if found:
+                return value
+
+            found, value, saved_at = last_known_good.get(namespace, good_key(args, kwargs))
+            if found and stale and not versioned and ttl is not None and ttl <= time.time() - saved_at <= CACHE_MAX_STALE_SECONDS:
+                # The st.cache_data entry has expired: serve the previous result
+                # now and refresh it off the viewer's script run.
+                _revalidate(namespace, key, cached_func, args, kwargs)
+                _record_stale_read(namespace, saved_at)
+                return value
+
+            try:
+                return cached_func(*args, **kwargs)
+            except UpstreamError as e:
+                if not found:
+                    raise
+                if stale:
+                    _record_stale_read(namespace, saved_at, str(e))
+                return value
+
+        wrapper.clear = cached_func.clear
+        return wrapper
+
+    return decorator
+
+
+def snap_open_end(end: datetime, bucket_seconds: int = REFRESH_BUCKET_SECONDS) -> datetime:
+    now = datetime.now(end.tzinfo)
+    if not (now - timedelta(seconds=bucket_seconds) <= end <= now):
+        return end
+
+    bucket_start = int(now.timestamp()) // bucket_seconds * bucket_seconds
+    return datetime.fromtimestamp(bucket_start, tz=end.tzinfo)
+
+
+def normalize_range(start_date: datetime, end_date: datetime) -> tuple:
+    return start_date.replace(microsecond=0), snap_open_end(end_date).replace(microsecond=0)
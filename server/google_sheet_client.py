@@ -1,36 +1,225 @@
+import hashlib
+import json
 import os
-import requests
-import streamlit as st
+import time
+
+import pandas as pd
+
+from server.cache import cached
+from server.http import UpstreamError, create_session, request
+from server.local_store import SheetStore
+from utils.data_processor import process_sheets_data
+
+# Append-only sheets are read from the last known row on; a full read every
+# this many seconds picks up edits and deletions.
+SHEETS_FULL_REREAD_SECONDS = int(os.environ.get('SHEETS_FULL_REREAD_SECONDS', '3600'))
+# Seconds between change probes; sheet data is kept until the probe reports
+# an edit.
+SHEETS_CHANGE_PROBE_SECONDS = int(os.environ.get('SHEETS_CHANGE_PROBE_SECONDS', '30'))
+# Without Drive access the probe hashes column A, which misses edits to
+# other columns; those are picked up after at most this many seconds.
+SHEETS_SENTINEL_MAX_AGE_SECONDS = int(os.environ.get('SHEETS_SENTINEL_MAX_AGE_SECONDS', '900'))
+# Versions of sheet data held per cached call, across all spreadsheets.
+SHEETS_CACHE_MAX_ENTRIES = 16
+DRIVE_FILES_PATH = 'google-drive/drive/v3/files'
+
+
+class InvalidRangeError(UpstreamError):
+    # HTTP 400 on a read, e.g. a range that starts below the sheet's grid.
+    def __init__(self, message: str):
+        super().__init__('google_sheets', message)
+
+
+def _a1_range(sheet_name: str, range_str: str) -> str:
+    # Sheet names with spaces or brackets must be quoted in A1 notation.
+    escaped = sheet_name.replace("'", "''")
+    return f"'{escaped}'!{range_str}"
+
 
 class GoogleSheetClient:
+    # Sheets the dashboards read from this spreadsheet.
+    SHEETS = (
+        'Leads [EA Alunos]', 'Leads [Geral]',
+        'Pesquisa [EA Alunos]', 'Pesquisa [Geral]',
+        'Entrou no Grupo [EA Alunos]', 'Entrou no Grupo [Geral]'
+    )
+    # Sheets that only ever grow at the bottom (form and group-join logs).
+    APPEND_ONLY_SHEETS = (
+        'Leads [EA Alunos]', 'Leads [Geral]',
+        'Entrou no Grupo [EA Alunos]', 'Entrou no Grupo [Geral]'
+    )
+    
     def __init__(self, spreadsheet_id: str = None):
         self.spreadsheet_id = spreadsheet_id or os.environ.get('GOOGLE_SPREADSHEET_ID', '')
         self.connector_hostname = os.environ.get('REPLIT_CONNECTORS_HOSTNAME', '')
-        self.identity_token = os.environ.get('WEB_REPL_RENEWAL') or os.environ.get('REPL_IDENTITY', '')
+        self.session = create_session()
+        self.store = SheetStore()
+        # Cleared when the connector has no Drive access to the spreadsheet.
+        self.drive_probe = True
     
     def _get_headers(self) -> dict:
+        # Read on every request: the client lives for the whole process and the
+        # Replit identity token is renewed underneath it.
+        identity_token = os.environ.get('WEB_REPL_RENEWAL') or os.environ.get('REPL_IDENTITY', '')
         return {
-            'Authorization': f'Bearer {self.identity_token}',
+            'Authorization': f'Bearer {identity_token}',
             'Content-Type': 'application/json'
         }
     
-    @st.cache_data(ttl=300, show_spinner=False)
-    def get_sheet_data(_self, sheet_name: str, range_str: str = 'A:Z') -> list:
-        if not _self.spreadsheet_id:
+    def _spreadsheet_url(self, spreadsheet_id: str) -> str:
+        return f"https://{self.connector_hostname}/google-sheets/spreadsheets/{spreadsheet_id}"
+    
+    def get_sheet_data(self, sheet_name: str, range_str: str = 'A:Z') -> list:
+        # Sheets declared in SHEETS come from the spreadsheet-wide batch read.
+        if sheet_name in self.SHEETS and range_str == 'A:Z':
+            return self.get_sheets().get(sheet_name, [])
+        return self._fetch_values(self.spreadsheet_id, sheet_name, range_str, self.get_change_token())
+    
+    def get_sheets(self) -> dict:
+        return self._fetch_batch(self.spreadsheet_id, self.SHEETS, self.get_change_token())
+    
+    def get_row_counts(self) -> dict:
+        return self._fetch_row_counts(self.spreadsheet_id, self.SHEETS, self.get_change_token())
+    
+    def get_row_count(self, sheet_name: str) -> int:
+        # Data rows (header excluded) without downloading the sheet.
+        if sheet_name in self.SHEETS:
+            return self.get_row_counts().get(sheet_name, 0)
+        return self._fetch_row_counts(self.spreadsheet_id, (sheet_name,), self.get_change_token()).get(sheet_name, 0)
+    
+    def get_sheet_frame(self, sheet_name: str) -> pd.DataFrame:
+        # Typed frame of a sheet, parsed once per version of the spreadsheet
+        # instead of on every rerun.
+        return self._fetch_frame(self.spreadsheet_id, sheet_name, self.get_change_token())
+    
+    def get_change_token(self) -> str:
+        # Changes whenever the spreadsheet is edited; the data reads below are
+        # cached per token, so unchanged sheets are never downloaded twice.
+        return self._fetch_change_token(self.spreadsheet_id, self.SHEETS)
+    
+    # spreadsheet_id is passed explicitly because st.cache_data does not hash
+    # _self: clients of different spreadsheets share sheet names (PESQUISA).
+    @cached('google_sheets.change_token', ttl=SHEETS_CHANGE_PROBE_SECONDS, publish=False, stale=False)
+    def _fetch_change_token(_self, spreadsheet_id: str, sheet_names: tuple) -> str:
+        if not spreadsheet_id or not _self.connector_hostname:
+            return ''
+        
+        if _self.drive_probe:
+            token = _self._drive_modified_time(spreadsheet_id)
+            if token:
+                return f"drive:{token}"
+        
+        # Sentinel: a hash of column A of every sheet catches added, removed
+        # and reordered rows; the time bucket bounds how long other edits wait.
+        value_ranges = _self._batch_get(spreadsheet_id, [_a1_range(sheet_name, 'A:A') for sheet_name in sheet_names])
+        digest = hashlib.sha1(json.dumps(value_ranges, sort_keys=True).encode('utf-8')).hexdigest()
+        return f"sentinel:{digest}:{int(time.time()) // SHEETS_SENTINEL_MAX_AGE_SECONDS}"
+    
+    def _drive_modified_time(self, spreadsheet_id: str) -> str | None:
+        response = request(
+            self.session, 'google_sheets', 'GET',
+            f"https://{self.connector_hostname}/{DRIVE_FILES_PATH}/{spreadsheet_id}",
+            headers=self._get_headers(),
+            params={'fields': 'modifiedTime', 'supportsAllDrives': 'true'}
+        )
+        
+        if response.status_code in (401, 403, 404):
+            # No Drive scope on the connector: stop asking, use the sentinel.
+            self.drive_probe = False
+            return None
+        if response.status_code != 200:
+            raise UpstreamError('google_sheets', f"Drive: HTTP {response.status_code}")
+        return response.json().get('modifiedTime')
+    
+    @cached('google_sheets.values', ttl=None, max_entries=SHEETS_CACHE_MAX_ENTRIES, publish=False, versioned=True)
+    def _fetch_values(_self, spreadsheet_id: str, sheet_name: str, range_str: str, change_token: str) -> list:
+        if not spreadsheet_id or not _self.connector_hostname:
             return []
         
-        try:
-            if _self.connector_hostname:
-                url = f"https://{_self.connector_hostname}/google-sheets/spreadsheets/{_self.spreadsheet_id}/values/{sheet_name}!{range_str}"
-                response = requests.get(url, headers=_self._get_headers())
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    return data.get('values', [])
-        except Exception as e:
-            st.error(f"Erro ao acessar Google Sheets: {e}")
+        url = f"{_self._spreadsheet_url(spreadsheet_id)}/values/{sheet_name}!{range_str}"
+        response = request(_self.session, 'google_sheets', 'GET', url, headers=_self._get_headers())
+        
+        if response.status_code != 200:
+            raise UpstreamError('google_sheets', f"{sheet_name}: HTTP {response.status_code}")
+        return response.json().get('values', [])
+    
+    def _batch_get(self, spreadsheet_id: str, ranges: list) -> list:
+        # valueRanges come back in the order of the requested ranges.
+        response = request(
+            self.session, 'google_sheets', 'GET', f"{self._spreadsheet_url(spreadsheet_id)}/values:batchGet",
+            headers=self._get_headers(),
+            params={'ranges': ranges}
+        )
+        
+        if response.status_code == 400:
+            raise InvalidRangeError(f"batchGet: HTTP {response.status_code}")
+        if response.status_code != 200:
+            raise UpstreamError('google_sheets', f"batchGet: HTTP {response.status_code}")
+        return response.json().get('valueRanges', [])
+    
+    @cached('google_sheets.row_counts', ttl=None, max_entries=SHEETS_CACHE_MAX_ENTRIES, publish=False, versioned=True)
+    def _fetch_row_counts(_self, spreadsheet_id: str, sheet_names: tuple, change_token: str) -> dict:
+        # Reads only column A of each sheet: the values API drops trailing
+        # empty rows, so its length is the last filled row. Rows whose first
+        # cell is empty at the very bottom of a sheet are not counted.
+        if not spreadsheet_id or not _self.connector_hostname:
+            return {sheet_name: 0 for sheet_name in sheet_names}
+        
+        value_ranges = _self._batch_get(spreadsheet_id, [_a1_range(sheet_name, 'A:A') for sheet_name in sheet_names])
+        return {
+            sheet_name: max(len(value_range.get('values', [])) - 1, 0)
+            for sheet_name, value_range in zip(sheet_names, value_ranges)
+        }
+    
+    @cached('google_sheets.frames', ttl=None, max_entries=SHEETS_CACHE_MAX_ENTRIES, publish=False, versioned=True)
+    def _fetch_frame(_self, spreadsheet_id: str, sheet_name: str, change_token: str) -> pd.DataFrame:
+        return process_sheets_data(_self.get_sheet_data(sheet_name))
+    
+    def _incremental_start(self, spreadsheet_id: str, sheet_name: str, now: float) -> int | None:
+        # First sheet row to request, or None for a full read.
+        if sheet_name not in self.APPEND_ONLY_SHEETS:
+            return None
         
-        return []
+        state = self.store.get_state(spreadsheet_id, sheet_name)
+        if not state or now - state[1] >= SHEETS_FULL_REREAD_SECONDS:
+            return None
+        return state[0] + 1
+    
+    @cached('google_sheets.batch', ttl=None, max_entries=SHEETS_CACHE_MAX_ENTRIES, publish=False, versioned=True)
+    def _fetch_batch(_self, spreadsheet_id: str, sheet_names: tuple, change_token: str) -> dict:
+        # One values:batchGet for every sheet.
+        if not spreadsheet_id or not _self.connector_hostname:
+            return {sheet_name: [] for sheet_name in sheet_names}
+        
+        now = time.time()
+        start_rows = [_self._incremental_start(spreadsheet_id, sheet_name, now) for sheet_name in sheet_names]
+        ranges = [
+            _a1_range(sheet_name, f"A{start_row}:Z" if start_row else 'A:Z')
+            for sheet_name, start_row in zip(sheet_names, start_rows)
+        ]
+        try:
+            value_ranges = _self._batch_get(spreadsheet_id, ranges)
+        except InvalidRangeError:
+            if not any(start_rows):
+                raise
+            # A sheet with no spare rows below its last one (Forms, appendRow)
+            # rejects A<last+1>:Z and fails the whole batch: read it in full.
+            start_rows = [None] * len(sheet_names)
+            value_ranges = _self._batch_get(spreadsheet_id, [_a1_range(sheet_name, 'A:Z') for sheet_name in sheet_names])
+        sheets = {}
+        for sheet_name, start_row, value_range in zip(sheet_names, start_rows, value_ranges):
+            values = value_range.get('values', [])
+            if sheet_name not in _self.APPEND_ONLY_SHEETS:
+                sheets[sheet_name] = values
+                continue
+            
+            # Append-only sheets are merged into the local copy and served from it.
+            if start_row is None:
+                _self.store.replace(spreadsheet_id, sheet_name, values, now)
+            else:
+                _self.store.append(spreadsheet_id, sheet_name, start_row, values)
+            sheets[sheet_name] = _self.store.load(spreadsheet_id, sheet_name)
+        return sheets
     
     def get_leads_alunos(self) -> list:
         return self.get_sheet_data('Leads [EA Alunos]')
@@ -52,6 +241,9 @@ class GoogleSheetClient:
 
 
 class ImersaoSheetClient(GoogleSheetClient):
+    SHEETS = ('VENDAS', 'REEMBOLSOS', 'PESQUISA', 'MONITORAMENTO GRUPOS')
+    APPEND_ONLY_SHEETS = ()
+
     def __init__(self):
         super().__init__(spreadsheet_id=os.environ.get('GOOGLE_SPREADSHEET_ID_IMERSAO0126', ''))
 
@@ -69,6 +261,9 @@ class ImersaoSheetClient(GoogleSheetClient):
 
 
 class DesafioSheetClient(GoogleSheetClient):
+    SHEETS = ('LEADS', 'PESQUISA', 'GRUPOS', 'ORIGEM DOS LEADS')
+    APPEND_ONLY_SHEETS = ('LEADS', 'GRUPOS')
+
     def __init__(self):
         super().__init__(spreadsheet_id=os.environ.get('GOOGLE_SPREADSHEET_ID_DESAFIO0326', ''))
 
@@ -1,133 +1,377 @@
+import bisect
+import math
 import os
-import requests
+import threading
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-import streamlit as st
+
+from server.cache import cached, normalize_range
+from server.http import UpstreamError, create_session, map_concurrently, request
+from server.local_store import SalesStore
+from server.singleflight import coalesced
 
 BRT = ZoneInfo('America/Sao_Paulo')
 
 HOTMART_AUTH_URL = "https://api-sec-vlc.hotmart.com/security/oauth/token"
 HOTMART_API_BASE = "https://developers.hotmart.com/payments/api/v1"
 
+# Days before the last synced day that each refresh of the approved series
+# pulls again (late approvals, orders landing after a sync).
+HOTMART_LOOKBACK_DAYS = int(os.environ.get('HOTMART_LOOKBACK_DAYS', '2'))
+# History is filtered by order_date, so a refund or chargeback shows up on
+# the day the order was placed. Refund and other filtered statuses are small
+# and walked over the whole range on every refresh; their rows replace the
+# approved copy of the same transaction. A range that closed this many days
+# before the last sync is served from the store.
+HOTMART_REFUND_WINDOW_DAYS = int(os.environ.get('HOTMART_REFUND_WINDOW_DAYS', '30'))
+# Every this many seconds a product/status is walked in full again, so
+# approved orders that were later removed or canceled are dropped too.
+HOTMART_FULL_SYNC_SECONDS = int(os.environ.get('HOTMART_FULL_SYNC_SECONDS', '604800'))
+
+# Windows fetched at the same time; 1 keeps the walk sequential.
+HOTMART_MAX_CONCURRENCY = int(os.environ.get('HOTMART_MAX_CONCURRENCY', '4'))
+
+# Statuses returned by /sales/history when no transaction_status is sent.
+# They are split out of that single pass; every other status falls back to
+# its own filtered walk.
+HOTMART_UNFILTERED_STATUSES = set(
+    status.strip() for status in os.environ.get('HOTMART_UNFILTERED_STATUSES', 'APPROVED,COMPLETE').split(',')
+    if status.strip()
+)
+
+HOTMART_PAGE_SIZE = 500
+
+# Windows needing more pages than this are split, down to HOTMART_MIN_WINDOW_MINUTES;
+# anything shallower is simply paginated.
+HOTMART_MAX_WINDOW_PAGES = int(os.environ.get('HOTMART_MAX_WINDOW_PAGES', '10'))
+HOTMART_MIN_WINDOW_MS = int(os.environ.get('HOTMART_MIN_WINDOW_MINUTES', '60')) * 60 * 1000
+
+APPROVED_STATUSES = ['APPROVED', 'COMPLETE']
+REFUND_STATUSES = ['REFUNDED', 'PARTIALLY_REFUNDED', 'CHARGEBACK', 'PROTESTED']
+
+
+class WalkStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.daily_walk_requests = 0
+    
+    def record(self, requests_made: int, daily_walk_requests: int):
+        with self._lock:
+            self.requests += requests_made
+            self.daily_walk_requests += daily_walk_requests
+    
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'daily_walk_requests': self.daily_walk_requests,
+                'saved': self.daily_walk_requests - self.requests
+            }
+
+
+walk_stats = WalkStats()
+
+
+def _split_window(window: tuple, parts: int) -> list:
+    start_ms, end_ms = window
+    parts = max(min(parts, (end_ms - start_ms) // HOTMART_MIN_WINDOW_MS), 2)
+    step = math.ceil((end_ms - start_ms + 1) / parts)
+    
+    windows = []
+    current = start_ms
+    while current <= end_ms:
+        windows.append((current, min(current + step - 1, end_ms)))
+        current += step
+    return windows
+
+
+def _daily_walk_requests(sales: list, start_date: datetime, end_date: datetime) -> int:
+    # What the fixed one-day walk would have cost for the same sales:
+    # one request per day plus one per extra page.
+    order_dates = sorted(sale['order_date'] or 0 for sale in sales)
+    
+    total = 0
+    current_date = start_date
+    while current_date <= end_date:
+        next_date = min(current_date + timedelta(days=1), end_date)
+        day_start = bisect.bisect_left(order_dates, int(current_date.timestamp() * 1000))
+        day_end = bisect.bisect_right(order_dates, int(next_date.timestamp() * 1000))
+        total += max(math.ceil((day_end - day_start) / HOTMART_PAGE_SIZE), 1)
+        current_date = next_date + timedelta(seconds=1)
+    return total
+
+
+def slim_sale(sale: dict) -> dict:
+    # Only these fields are ever read downstream; dropping the rest of the
+    # payload here keeps the store, st.cache_data and the pickles small.
+    purchase = sale.get('purchase', {})
+    buyer = sale.get('buyer', {})
+    product_id = sale.get('product', {}).get('id')
+    
+    return {
+        'transaction_id': purchase.get('transaction'),
+        'product_id': str(product_id) if product_id is not None else None,
+        'order_date': purchase.get('order_date'),
+        'status': purchase.get('status'),
+        'value': purchase.get('hotmart_fee', {}).get('base', 0),
+        'buyer_email': buyer.get('email'),
+        'buyer_name': buyer.get('name'),
+        'offer_code': purchase.get('offer', {}).get('code')
+    }
+
+
+def _dedupe_sales(sales) -> list:
+    seen = set()
+    result = []
+    for sale in sales:
+        transaction_id = sale['transaction_id']
+        if transaction_id and transaction_id not in seen:
+            seen.add(transaction_id)
+            result.append(sale)
+    return result
+
+
+def _merge_statuses(by_status: dict, statuses: list) -> list:
+    return _dedupe_sales(sale for status in statuses for sale in by_status[status])
+
+
 class HotmartClient:
     def __init__(self):
         self.basic_token = os.environ.get('HOTMART_BASIC_TOKEN', '')
         self.access_token = None
         self.token_expires_at = None
+        self.store = SalesStore()
+        self.max_concurrency = max(HOTMART_MAX_CONCURRENCY, 1)
+        self.session = create_session(self.max_concurrency)
+        self._token_lock = threading.Lock()
+    
+    def _token_valid(self) -> bool:
+        return bool(self.access_token and self.token_expires_at and datetime.now() < self.token_expires_at)
     
     def _ensure_token(self):
-        if self.access_token and self.token_expires_at and datetime.now() < self.token_expires_at:
+        if self._token_valid():
             return True
         
         if not self.basic_token:
             return False
         
-        try:
-            response = requests.post(
-                HOTMART_AUTH_URL,
-                headers={
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                    'Authorization': f'Basic {self.basic_token}'
-                },
-                data={'grant_type': 'client_credentials'}
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                self.access_token = data.get('access_token')
-                expires_in = data.get('expires_in', 3600)
-                self.token_expires_at = datetime.now() + timedelta(seconds=expires_in - 60)
+        # The client is shared by every session: only one thread refreshes the
+        # token, the others wait and reuse it.
+        with self._token_lock:
+            if self._token_valid():
                 return True
-        except Exception as e:
-            st.error(f"Erro na autenticação Hotmart: {e}")
+            return self._refresh_token()
+    
+    def _refresh_token(self) -> bool:
+        response = request(
+            self.session, 'hotmart', 'POST', HOTMART_AUTH_URL,
+            headers={
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'Authorization': f'Basic {self.basic_token}'
+            },
+            data={'grant_type': 'client_credentials'}
+        )
+        
+        if response.status_code != 200:
+            raise UpstreamError('hotmart', f"autenticação falhou (HTTP {response.status_code})")
         
-        return False
+        data = response.json()
+        self.access_token = data.get('access_token')
+        expires_in = data.get('expires_in', 3600)
+        self.token_expires_at = datetime.now() + timedelta(seconds=expires_in - 60)
+        return True
     
-    @st.cache_data(ttl=300, show_spinner=False)
-    def get_sales_history(_self, product_id: str, start_date: datetime, end_date: datetime, 
+    def get_sales_history(self, product_id: str | None, start_date: datetime, end_date: datetime,
                           status: str = None) -> list:
+        start_date, end_date = normalize_range(start_date, end_date)
+        return self._fetch_sales_history(product_id, start_date, end_date, status)
+    
+    @cached('hotmart.sales_history')
+    def _fetch_sales_history(_self, product_id: str | None, start_date: datetime, end_date: datetime,
+                             status: str = None) -> list:
         if not _self._ensure_token():
             return []
         
-        all_sales = []
-        seen_transactions = set()
+        start_ms = int(start_date.timestamp() * 1000)
+        end_ms = int(end_date.timestamp() * 1000)
+        now = datetime.now(BRT)
+        now_ms = int(now.timestamp() * 1000)
+        filtered = status is not None and status not in HOTMART_UNFILTERED_STATUSES
+        lookback = timedelta(days=HOTMART_REFUND_WINDOW_DAYS if filtered else HOTMART_LOOKBACK_DAYS)
         
-        current_date = start_date
-        while current_date <= end_date:
-            next_date = min(current_date + timedelta(days=1), end_date)
+        fetch_start = start_date
+        synced_from, synced_until, full_sync_at = start_ms, end_ms, now_ms
+        state = _self.store.get_sync_state(product_id, status)
+        full_due = not state or state[3] is None or now_ms - state[3] >= HOTMART_FULL_SYNC_SECONDS * 1000
+        if not full_due and state[0] <= start_ms <= state[1]:
+            last_synced_until = datetime.fromtimestamp(state[1] / 1000, tz=BRT)
+            last_synced_at = datetime.fromtimestamp(state[2] / 1000, tz=BRT)
             
-            start_ms = int(current_date.timestamp() * 1000)
-            end_ms = int(next_date.timestamp() * 1000)
+            if state[1] >= end_ms and last_synced_at - end_date > lookback:
+                # Range closed more than the look-back before the last sync:
+                # nothing in it is expected to change any more.
+                return _self.store.load(product_id, start_ms, end_ms, status)
             
-            page_token = None
-            while True:
-                params = {
-                    'product_id': product_id,
-                    'start_date': start_ms,
-                    'end_date': end_ms,
-                    'max_results': 500
-                }
-                
-                if status:
-                    params['transaction_status'] = status
-                
-                if page_token:
-                    params['page_token'] = page_token
-                
-                try:
-                    response = requests.get(
-                        f"{HOTMART_API_BASE}/sales/history",
-                        headers={'Authorization': f'Bearer {_self.access_token}'},
-                        params=params
-                    )
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        items = data.get('items', [])
-                        
-                        for sale in items:
-                            transaction_id = sale.get('purchase', {}).get('transaction')
-                            if transaction_id and transaction_id not in seen_transactions:
-                                seen_transactions.add(transaction_id)
-                                all_sales.append(sale)
-                        
-                        page_token = data.get('page_info', {}).get('next_page_token')
-                        if not page_token or len(items) == 0:
-                            break
-                    else:
-                        break
-                except Exception:
-                    break
+            if not filtered:
+                open_day = last_synced_until.replace(hour=0, minute=0, second=0, microsecond=0)
+                fetch_start = max(start_date, open_day - lookback)
+            synced_from, synced_until, full_sync_at = state[0], max(state[1], end_ms), state[3]
+        
+        sales = _self._walk_sales_history(product_id, fetch_start, end_date, status)
+        _self.store.save(
+            product_id, status, sales, synced_from, synced_until, now_ms, full_sync_at,
+            (int(fetch_start.timestamp() * 1000), end_ms),
+            (status,) if status else tuple(sorted(HOTMART_UNFILTERED_STATUSES))
+        )
+        
+        return _self.store.load(product_id, start_ms, end_ms, status)
+    
+    @coalesced('hotmart.sales_walk')
+    def _walk_sales_history(self, product_id: str | None, start_date: datetime, end_date: datetime,
+                            status: str = None) -> list:
+        # Start from one window over the whole range. Quiet stretches stay merged
+        # in it; windows whose first page reports a deep pagination are split
+        # (down to one hour) so their pages can be fetched in parallel.
+        frontier = [(int(start_date.timestamp() * 1000), int(end_date.timestamp() * 1000))]
+        finished = []
+        dense = []
+        requests_made = 0
+        
+        while frontier:
+            probes = map_concurrently(lambda window: self._fetch_page(product_id, window, status), frontier, self.max_concurrency)
+            requests_made += len(frontier)
             
-            current_date = next_date + timedelta(seconds=1)
+            next_frontier = []
+            for window, (items, page_info) in zip(frontier, probes):
+                page_token = page_info.get('next_page_token')
+                pages = math.ceil(page_info.get('total_results', 0) / HOTMART_PAGE_SIZE)
+                if not page_token or not items:
+                    finished.append((window, items))
+                elif pages > HOTMART_MAX_WINDOW_PAGES and window[1] - window[0] > HOTMART_MIN_WINDOW_MS:
+                    # Aim at half the page budget per part so uneven parts rarely split again.
+                    next_frontier.extend(_split_window(window, math.ceil(2 * pages / HOTMART_MAX_WINDOW_PAGES)))
+                else:
+                    dense.append((window, items, page_token))
+            frontier = next_frontier
+        
+        def follow(job):
+            window, items, page_token = job
+            remaining, pages = self._fetch_remaining_pages(product_id, window, status, page_token)
+            return window, items + remaining, pages
         
-        return all_sales
+        for window, items, pages in map_concurrently(follow, dense, self.max_concurrency):
+            finished.append((window, items))
+            requests_made += pages
+        
+        finished.sort(key=lambda result: result[0])
+        sales = _dedupe_sales(sale for _, items in finished for sale in items)
+        
+        walk_stats.record(requests_made, _daily_walk_requests(sales, start_date, end_date))
+        return sales
     
-    def get_approved_sales(self, product_id: str, start_date: datetime, end_date: datetime) -> list:
-        approved = self.get_sales_history(product_id, start_date, end_date, 'APPROVED')
-        complete = self.get_sales_history(product_id, start_date, end_date, 'COMPLETE')
+    def _fetch_page(self, product_id: str | None, window: tuple, status: str = None,
+                    page_token: str = None) -> tuple:
+        params = {
+            'start_date': window[0],
+            'end_date': window[1],
+            'max_results': HOTMART_PAGE_SIZE
+        }
+        
+        # Without product_id the history covers every product of the account.
+        if product_id:
+            params['product_id'] = product_id
+        
+        if status:
+            params['transaction_status'] = status
+        
+        if page_token:
+            params['page_token'] = page_token
+        
+        # A failed page fails the whole walk: a partial history must never be
+        # stored or cached as if it were complete.
+        response = request(
+            self.session, 'hotmart', 'GET', f"{HOTMART_API_BASE}/sales/history",
+            headers={'Authorization': f'Bearer {self.access_token}'},
+            params=params
+        )
         
-        seen = set()
-        result = []
-        for sale in approved + complete:
-            tid = sale.get('purchase', {}).get('transaction')
-            if tid not in seen:
-                seen.add(tid)
-                result.append(sale)
+        if response.status_code != 200:
+            raise UpstreamError('hotmart', f"histórico de vendas falhou (HTTP {response.status_code})")
         
-        return result
+        data = response.json()
+        return [slim_sale(sale) for sale in data.get('items', [])], data.get('page_info', {})
+    
+    def _fetch_remaining_pages(self, product_id: str | None, window: tuple, status: str,
+                               page_token: str) -> tuple:
+        sales = []
+        pages = 0
+        while page_token:
+            items, page_info = self._fetch_page(product_id, window, status, page_token)
+            pages += 1
+            sales.extend(items)
+            
+            page_token = page_info.get('next_page_token') if items else None
+        
+        return sales, pages
+    
+    def get_sales_by_status(self, product_id: str | None, start_date: datetime, end_date: datetime,
+                            statuses: list) -> dict:
+        by_status = {status: [] for status in statuses}
+        filtered = [status for status in statuses if status not in HOTMART_UNFILTERED_STATUSES]
+        unfiltered = len(filtered) < len(statuses)
+        if unfiltered:
+            # Approved orders older than the look-back only leave the approved
+            # series when a refund walk replaces their row, so refunds go first.
+            filtered += [
+                status for status in REFUND_STATUSES
+                if status not in filtered and status not in HOTMART_UNFILTERED_STATUSES
+            ]
+        
+        for status in filtered:
+            sales = self.get_sales_history(product_id, start_date, end_date, status)
+            if status in by_status:
+                by_status[status] = sales
+        
+        if unfiltered:
+            for sale in self.get_sales_history(product_id, start_date, end_date):
+                status = sale['status']
+                if status in by_status and status in HOTMART_UNFILTERED_STATUSES:
+                    by_status[status].append(sale)
+        
+        return by_status
+    
+    def get_sales_by_product(self, product_ids: list, start_date: datetime, end_date: datetime,
+                             statuses: list) -> dict:
+        # One account-wide walk per status group, indexed by product in memory,
+        # instead of one walk per product.
+        by_product = {str(product_id): {status: [] for status in statuses} for product_id in product_ids}
+        
+        account_sales = self.get_sales_by_status(None, start_date, end_date, statuses)
+        for status, sales in account_sales.items():
+            for sale in sales:
+                product_id = sale['product_id']
+                if product_id in by_product:
+                    by_product[product_id][status].append(sale)
+        
+        return by_product
+    
+    def get_approved_sales(self, product_id: str, start_date: datetime, end_date: datetime) -> list:
+        by_status = self.get_sales_by_status(product_id, start_date, end_date, APPROVED_STATUSES)
+        return _merge_statuses(by_status, APPROVED_STATUSES)
     
     def get_refunded_sales(self, product_id: str, start_date: datetime, end_date: datetime) -> list:
-        refund_statuses = ['REFUNDED', 'PARTIALLY_REFUNDED', 'CHARGEBACK', 'PROTESTED']
-        all_refunds = []
-        seen = set()
-        
-        for status in refund_statuses:
-            refunds = self.get_sales_history(product_id, start_date, end_date, status)
-            for sale in refunds:
-                tid = sale.get('purchase', {}).get('transaction')
-                if tid not in seen:
-                    seen.add(tid)
-                    all_refunds.append(sale)
-        
-        return all_refunds
+        by_status = self.get_sales_by_status(product_id, start_date, end_date, REFUND_STATUSES)
+        return _merge_statuses(by_status, REFUND_STATUSES)
+    
+    def get_approved_sales_by_product(self, product_ids: list, start_date: datetime,
+                                      end_date: datetime) -> dict:
+        by_product = self.get_sales_by_product(product_ids, start_date, end_date, APPROVED_STATUSES)
+        return {product_id: _merge_statuses(by_status, APPROVED_STATUSES)
+                for product_id, by_status in by_product.items()}
+    
+    def get_refunded_sales_by_product(self, product_ids: list, start_date: datetime,
+                                      end_date: datetime) -> dict:
+        by_product = self.get_sales_by_product(product_ids, start_date, end_date, REFUND_STATUSES)
+        return {product_id: _merge_statuses(by_status, REFUND_STATUSES)
+                for product_id, by_status in by_product.items()}
@@ -0,0 +1,146 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DEFAULT_POOL_SIZE = 10
+
+# (connect, read) seconds; no upstream call may hold a script run forever.
+HTTP_TIMEOUT = (
+    float(os.environ.get('HTTP_CONNECT_TIMEOUT_SECONDS', '5')),
+    float(os.environ.get('HTTP_READ_TIMEOUT_SECONDS', '30'))
+)
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', '2'))
+HTTP_BACKOFF_SECONDS = float(os.environ.get('HTTP_BACKOFF_SECONDS', '0.5'))
+HTTP_BACKOFF_MAX_SECONDS = 8
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_SECONDS = int(os.environ.get('CIRCUIT_RESET_SECONDS', '60'))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    def __init__(self, integration: str, message: str):
+        super().__init__(f"{integration}: {message}")
+        self.integration = integration
+
+
+class CircuitBreaker:
+    # Closed: requests flow. Open: after consecutive failures, requests fail
+    # fast until reset_seconds pass. Half-open: one trial request decides.
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_seconds: int = CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_seconds or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at < self.reset_seconds:
+                return 'open'
+            return 'half-open'
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(integration: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if integration not in _breakers:
+            _breakers[integration] = CircuitBreaker(integration)
+        return _breakers[integration]
+
+
+def breaker_states() -> dict:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.state for breaker in sorted(breakers, key=lambda b: b.name)}
+
+
+def create_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    # One pooled keep-alive session per shared client; requests.Session is
+    # safe to share between script threads for plain request/response use.
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def map_concurrently(func, items: list, max_workers: int) -> list:
+    # Results in the order of items; up to max_workers calls share the
+    # client's session pool at once.
+    if max_workers > 1 and len(items) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+            return list(pool.map(func, items))
+    return [func(item) for item in items]
+
+
+def _backoff(attempt: int) -> float:
+    # Exponential backoff with full jitter.
+    return random.uniform(0, min(HTTP_BACKOFF_MAX_SECONDS, HTTP_BACKOFF_SECONDS * 2 ** attempt))
+
+
+def request(session: requests.Session, integration: str, method: str, url: str,
+            **kwargs) -> requests.Response:
+    # Returns any non-retryable response (the caller checks the status);
+    # raises UpstreamError when the integration is down or retries run out.
+    breaker = get_breaker(integration)
+    if not breaker.allow():
+        raise UpstreamError(integration, 'circuito aberto após falhas consecutivas')
+
+    kwargs.setdefault('timeout', HTTP_TIMEOUT)
+    error = None
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(_backoff(attempt - 1))
+
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            error = str(e)
+            continue
+        except BaseException:
+            breaker.record_failure()
+            raise
+
+        if response.status_code not in RETRYABLE_STATUS_CODES:
+            breaker.record_success()
+            return response
+        error = f"HTTP {response.status_code}"
+
+    breaker.record_failure()
+    raise UpstreamError(integration, error)
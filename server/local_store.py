@@ -0,0 +1,301 @@
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+DATA_DIR = os.environ.get('DASHBOARD_DATA_DIR', 'data')
+
+
+def connect(filename: str) -> sqlite3.Connection:
+    os.makedirs(DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(DATA_DIR, filename), timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+
+SALE_COLUMNS = (
+    'transaction_id', 'product_id', 'order_date', 'status',
+    'value', 'buyer_email', 'buyer_name', 'offer_code'
+)
+
+
+class SalesStore:
+    def __init__(self, filename: str = 'hotmart_sales_v2.sqlite'):
+        self._lock = threading.Lock()
+        self._conn = connect(filename)
+        with self._conn:
+            # One row per slim sale record (see hotmart_client.slim_sale).
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sales (
+                    transaction_id TEXT PRIMARY KEY,
+                    product_id TEXT,
+                    order_date INTEGER,
+                    status TEXT,
+                    value REAL,
+                    buyer_email TEXT,
+                    buyer_name TEXT,
+                    offer_code TEXT
+                )
+            """)
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS sales_product_date ON sales (product_id, order_date)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS sales_date ON sales (order_date)')
+            # High-water mark per product/status: the [synced_from, synced_until]
+            # range already mirrored locally and when it was last pulled.
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    product_id TEXT,
+                    status TEXT,
+                    synced_from INTEGER,
+                    synced_until INTEGER,
+                    synced_at INTEGER,
+                    full_sync_at INTEGER,
+                    PRIMARY KEY (product_id, status)
+                )
+            """)
+            # Stores created before full re-walks were tracked.
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(sync_state)')]
+            if 'full_sync_at' not in columns:
+                self._conn.execute('ALTER TABLE sync_state ADD COLUMN full_sync_at INTEGER')
+
+    def get_sync_state(self, product_id: str | None, status: str = None) -> tuple:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT synced_from, synced_until, synced_at, full_sync_at FROM sync_state '
+                'WHERE product_id = ? AND status = ?',
+                (product_id or '*', status or '*')
+            ).fetchone()
+        return row
+
+    def save(self, product_id: str | None, status: str, sales: list,
+             synced_from: int, synced_until: int, synced_at: int, full_sync_at: int,
+             walked: tuple, statuses: tuple):
+        # walked: the (start_ms, end_ms) range just pulled for these statuses.
+        # Stored sales in it that the walk no longer returned changed status
+        # (a refund, a chargeback) and are dropped before the upsert.
+        rows = [tuple(sale[column] for column in SALE_COLUMNS) for sale in sales]
+        query = (
+            f"DELETE FROM sales WHERE order_date BETWEEN ? AND ? "
+            f"AND status IN ({', '.join('?' for _ in statuses)})"
+        )
+        params = [walked[0], walked[1], *statuses]
+        if product_id:
+            query += ' AND product_id = ?'
+            params.append(product_id)
+
+        with self._lock, self._conn:
+            self._conn.execute(query, params)
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO sales ({', '.join(SALE_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in SALE_COLUMNS)})",
+                rows
+            )
+            self._conn.execute(
+                'INSERT OR REPLACE INTO sync_state '
+                '(product_id, status, synced_from, synced_until, synced_at, full_sync_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (product_id or '*', status or '*', synced_from, synced_until, synced_at, full_sync_at)
+            )
+
+    def load(self, product_id: str | None, start_ms: int, end_ms: int, status: str = None) -> list:
+        query = f"SELECT {', '.join(SALE_COLUMNS)} FROM sales WHERE order_date BETWEEN ? AND ?"
+        params = [start_ms, end_ms]
+        if product_id:
+            query += ' AND product_id = ?'
+            params.append(product_id)
+        if status:
+            query += ' AND status = ?'
+            params.append(status)
+        query += ' ORDER BY order_date, transaction_id'
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [dict(zip(SALE_COLUMNS, row)) for row in rows]
+
+
+class SheetStore:
+    def __init__(self, filename: str = 'google_sheets.sqlite'):
+        self._lock = threading.Lock()
+        self._conn = connect(filename)
+        with self._conn:
+            # One row per sheet row (1-based, header included); cells as JSON.
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sheet_rows (
+                    spreadsheet_id TEXT,
+                    sheet_name TEXT,
+                    row_index INTEGER,
+                    cells TEXT,
+                    PRIMARY KEY (spreadsheet_id, sheet_name, row_index)
+                )
+            """)
+            # Rows mirrored so far and when the sheet was last read in full.
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS sheet_state (
+                    spreadsheet_id TEXT,
+                    sheet_name TEXT,
+                    row_count INTEGER,
+                    full_read_at REAL,
+                    PRIMARY KEY (spreadsheet_id, sheet_name)
+                )
+            """)
+
+    def get_state(self, spreadsheet_id: str, sheet_name: str) -> tuple:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT row_count, full_read_at FROM sheet_state WHERE spreadsheet_id = ? AND sheet_name = ?',
+                (spreadsheet_id, sheet_name)
+            ).fetchone()
+        return row
+
+    def replace(self, spreadsheet_id: str, sheet_name: str, rows: list, read_at: float):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'DELETE FROM sheet_rows WHERE spreadsheet_id = ? AND sheet_name = ?',
+                (spreadsheet_id, sheet_name)
+            )
+            self._insert_rows(spreadsheet_id, sheet_name, 1, rows)
+            self._conn.execute(
+                'INSERT OR REPLACE INTO sheet_state (spreadsheet_id, sheet_name, row_count, full_read_at) '
+                'VALUES (?, ?, ?, ?)',
+                (spreadsheet_id, sheet_name, len(rows), read_at)
+            )
+
+    def append(self, spreadsheet_id: str, sheet_name: str, start_row: int, rows: list):
+        if not rows:
+            return
+
+        with self._lock, self._conn:
+            self._insert_rows(spreadsheet_id, sheet_name, start_row, rows)
+            self._conn.execute(
+                'UPDATE sheet_state SET row_count = MAX(row_count, ?) WHERE spreadsheet_id = ? AND sheet_name = ?',
+                (start_row + len(rows) - 1, spreadsheet_id, sheet_name)
+            )
+
+    def _insert_rows(self, spreadsheet_id: str, sheet_name: str, start_row: int, rows: list):
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO sheet_rows (spreadsheet_id, sheet_name, row_index, cells) VALUES (?, ?, ?, ?)',
+            [
+                (spreadsheet_id, sheet_name, start_row + offset, json.dumps(row, ensure_ascii=False))
+                for offset, row in enumerate(rows)
+            ]
+        )
+
+    def load(self, spreadsheet_id: str, sheet_name: str) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT cells FROM sheet_rows WHERE spreadsheet_id = ? AND sheet_name = ? ORDER BY row_index',
+                (spreadsheet_id, sheet_name)
+            ).fetchall()
+        return [json.loads(cells) for cells, in rows]
+
+
+class TagSetStore:
+    def __init__(self, filename: str = 'manychat_tags.sqlite'):
+        self._lock = threading.Lock()
+        self._conn = connect(filename)
+        with self._conn:
+            # Sorted int64 subscriber ids per ManyChat tag, as raw bytes, and
+            # when the tag was last pulled in full.
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS tag_sets (
+                    tag_id TEXT PRIMARY KEY,
+                    ids BLOB,
+                    full_sync_at REAL
+                )
+            """)
+
+    def get(self, tag_id) -> tuple:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT ids, full_sync_at FROM tag_sets WHERE tag_id = ?', (str(tag_id),)
+            ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.int64), row[1]
+
+    def save(self, tag_id, ids: np.ndarray, full_sync_at: float):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO tag_sets (tag_id, ids, full_sync_at) VALUES (?, ?, ?)',
+                (str(tag_id), np.ascontiguousarray(ids, dtype=np.int64).tobytes(), full_sync_at)
+            )
+
+
+INSIGHT_COLUMNS = ('day', 'impressions', 'clicks', 'inline_link_clicks', 'spend', 'actions')
+
+
+class InsightsStore:
+    def __init__(self, filename: str = 'meta_insights.sqlite'):
+        self._lock = threading.Lock()
+        self._conn = connect(filename)
+        with self._conn:
+            # One row per Meta Ads campaign filter and day (YYYY-MM-DD); actions
+            # as JSON.
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS daily_insights (
+                    campaign_filter TEXT,
+                    day TEXT,
+                    impressions INTEGER,
+                    clicks INTEGER,
+                    inline_link_clicks INTEGER,
+                    spend REAL,
+                    actions TEXT,
+                    PRIMARY KEY (campaign_filter, day)
+                )
+            """)
+            # Contiguous [synced_from, synced_until] range mirrored per filter.
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS insights_state (
+                    campaign_filter TEXT PRIMARY KEY,
+                    synced_from TEXT,
+                    synced_until TEXT,
+                    synced_at REAL
+                )
+            """)
+
+    def get_state(self, campaign_filter: str) -> tuple:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT synced_from, synced_until, synced_at FROM insights_state WHERE campaign_filter = ?',
+                (campaign_filter,)
+            ).fetchone()
+        return row
+
+    def save(self, campaign_filter: str, pulled: list, rows: list,
+             synced_from: str, synced_until: str, synced_at: float):
+        # pulled: the (since, until) ranges just read; their old rows go first,
+        # so a day Meta no longer reports disappears.
+        with self._lock, self._conn:
+            for since, until in pulled:
+                self._conn.execute(
+                    'DELETE FROM daily_insights WHERE campaign_filter = ? AND day BETWEEN ? AND ?',
+                    (campaign_filter, since, until)
+                )
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO daily_insights (campaign_filter, {', '.join(INSIGHT_COLUMNS)}) "
+                f"VALUES (?, {', '.join('?' for _ in INSIGHT_COLUMNS)})",
+                [
+                    (campaign_filter, *(json.dumps(row[column]) if column == 'actions' else row[column]
+                                        for column in INSIGHT_COLUMNS))
+                    for row in rows
+                ]
+            )
+            self._conn.execute(
+                'INSERT OR REPLACE INTO insights_state (campaign_filter, synced_from, synced_until, synced_at) '
+                'VALUES (?, ?, ?, ?)',
+                (campaign_filter, synced_from, synced_until, synced_at)
+            )
+
+    def load(self, campaign_filter: str, since: str, until: str) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(INSIGHT_COLUMNS)} FROM daily_insights "
+                'WHERE campaign_filter = ? AND day BETWEEN ? AND ? ORDER BY day',
+                (campaign_filter, since, until)
+            ).fetchall()
+        return [
+            {**dict(zip(INSIGHT_COLUMNS, row)), 'actions': json.loads(row[-1])}
+            for row in rows
+        ]
@@ -1,8 +1,20 @@
 import os
-import requests
-import streamlit as st
+import time
+
+import numpy as np
+
+from server.cache import cached
+from server.http import UpstreamError, create_session, map_concurrently, request
+from server.local_store import TagSetStore
+from server.singleflight import single_flight
 
 MANYCHAT_BASE_URL = "https://api.manychat.com/fb"
+# Tags counted at the same time; ManyChat rate-limits per token.
+MANYCHAT_MAX_CONCURRENCY = int(os.environ.get('MANYCHAT_MAX_CONCURRENCY', '4'))
+MANYCHAT_PAGE_SIZE = 100
+# Tag sets are topped up from their last full page; a full pull every this
+# many seconds drops subscribers who lost the tag.
+MANYCHAT_TAG_FULL_SYNC_SECONDS = int(os.environ.get('MANYCHAT_TAG_FULL_SYNC_SECONDS', '3600'))
 
 BF25_TAGS = {
     'alunos_boas_vindas_recebeu': '[BF25]-LEAD-ALUNO-BOASVINDAS-RECEBEU',
@@ -18,6 +30,34 @@ BF25_TAGS = {
     'geral_interagiu_convite': 'BF25-INTERAGIU-DISPARO-API-CONVITE-GERAL'
 }
 
+# Funnel steps in order; each step counts subscribers holding every tag so far.
+BF25_FUNNELS = {
+    'alunos': (
+        BF25_TAGS['alunos_boas_vindas_recebeu'],
+        BF25_TAGS['alunos_boas_vindas_clicou']
+    ),
+    'geral': (
+        BF25_TAGS['geral_boas_vindas_recebeu'],
+        BF25_TAGS['geral_boas_vindas_clicou'],
+        BF25_TAGS['geral_clicou_link_lp'],
+        BF25_TAGS['geral_deixou_telefone']
+    )
+}
+
+def slim_subscriber(subscriber: dict) -> dict:
+    # The fields funnels need; custom fields and profile data are dropped.
+    return {
+        'id': str(subscriber.get('id')),
+        'phone': subscriber.get('whatsapp_phone') or subscriber.get('phone'),
+        'tags': [tag.get('name') for tag in subscriber.get('tags') or []],
+        'subscribed_at': subscriber.get('subscribed')
+    }
+
+
+def _page_ids(pages: list) -> np.ndarray:
+    return np.fromiter((int(subscriber['id']) for page in pages for subscriber in page), dtype=np.int64)
+
+
 class ManyChatClient:
     def __init__(self):
         self.api_token = os.environ.get('MANYCHAT_API_TOKEN', '')
@@ -25,57 +65,166 @@ class ManyChatClient:
             'Authorization': f'Bearer {self.api_token}',
             'Content-Type': 'application/json'
         }
+        self.max_concurrency = max(MANYCHAT_MAX_CONCURRENCY, 1)
+        self.session = create_session(self.max_concurrency)
+        self.tag_store = TagSetStore()
     
     def _make_request(self, endpoint: str, method: str = 'GET', data: dict = None) -> dict:
         if not self.api_token:
             return {}
         
+        # Identical in-flight reads from concurrent sessions share one request.
+        key = (endpoint, method, tuple(sorted((data or {}).items())))
+        return single_flight.do('manychat.request', key, self._send, endpoint, method, data)
+    
+    def _send(self, endpoint: str, method: str, data: dict) -> dict:
         url = f"{MANYCHAT_BASE_URL}{endpoint}"
         
-        try:
-            if method == 'GET':
-                response = requests.get(url, headers=self.headers)
-            else:
-                response = requests.post(url, headers=self.headers, json=data)
-            
-            if response.status_code == 200:
-                return response.json()
-        except Exception as e:
-            st.error(f"Erro ManyChat: {e}")
-        
-        return {}
+        response = request(self.session, 'manychat', method, url, headers=self.headers, json=data)
+        if response.status_code != 200:
+            raise UpstreamError('manychat', f"HTTP {response.status_code}")
+        return response.json()
     
-    @st.cache_data(ttl=300, show_spinner=False)
+    @cached('manychat.page_stats')
     def get_page_stats(_self) -> dict:
         result = _self._make_request('/page/getStats')
         return result.get('data', {})
     
-    @st.cache_data(ttl=300, show_spinner=False)
+    @cached('manychat.tags')
     def get_tags(_self) -> list:
         result = _self._make_request('/page/getTags')
         return result.get('data', [])
     
-    @st.cache_data(ttl=300, show_spinner=False)
+    @cached('manychat.tag_index')
+    def get_tag_index(_self) -> dict:
+        return {tag.get('name'): tag.get('id') for tag in _self.get_tags() if tag.get('id')}
+    
+    @cached('manychat.subscribers_by_tag')
     def get_subscribers_by_tag(_self, tag_name: str) -> list:
-        tags = _self.get_tags()
-        tag_id = None
-        
-        for tag in tags:
-            if tag.get('name') == tag_name:
-                tag_id = tag.get('id')
-                break
-        
+        return list(_self.iter_subscribers_by_tag(tag_name))
+    
+    def iter_subscribers_by_tag(self, tag_name: str):
+        # Streams slim records page by page; memory stays at one page however
+        # large the tag is.
+        tag_id = self.get_tag_index().get(tag_name)
         if not tag_id:
-            return []
+            return
         
-        result = _self._make_request('/subscribers/findByTag', 'POST', {'tag_id': tag_id})
+        for page in self._iter_tag_pages(tag_id):
+            for subscriber in page:
+                yield slim_subscriber(subscriber)
+    
+    def _fetch_tag_page(self, tag_id, page_number: int) -> list:
+        result = self._make_request('/subscribers/findByTag', 'POST', {
+            'tag_id': tag_id,
+            'page': page_number,
+            'limit': MANYCHAT_PAGE_SIZE
+        })
         return result.get('data', [])
     
-    def get_bf25_metrics(self) -> dict:
-        metrics = {}
+    def _iter_tag_pages(self, tag_id, page_number: int = 1):
+        previous_ids = None
+        while True:
+            page = self._fetch_tag_page(tag_id, page_number)
+            
+            # An endpoint that ignores paging returns the same page again.
+            ids = [subscriber.get('id') for subscriber in page]
+            if not page or ids == previous_ids:
+                return
+            yield page
+            
+            if len(page) < MANYCHAT_PAGE_SIZE:
+                return
+            previous_ids = ids
+            page_number += 1
+    
+    @cached('manychat.tag_counts')
+    def get_tag_counts(_self, tag_names: tuple) -> dict:
+        # Only {tag name: subscriber count} is cached; unknown tags count 0.
+        index = _self.get_tag_index()
+        tag_ids = list(dict.fromkeys(index[tag_name] for tag_name in tag_names if tag_name in index))
+        counts = dict(zip(tag_ids, map_concurrently(_self._count_subscribers, tag_ids, _self.max_concurrency)))
+        return {tag_name: counts.get(index.get(tag_name), 0) for tag_name in tag_names}
+    
+    def _count_subscribers(self, tag_id) -> int:
+        return len(self._sync_tag_ids(tag_id))
+    
+    def get_tag_ids(self, tag_name: str) -> np.ndarray:
+        # Sorted, unique subscriber ids holding the tag.
+        tag_id = self.get_tag_index().get(tag_name)
+        if not tag_id:
+            return np.empty(0, dtype=np.int64)
+        return self._sync_tag_ids(tag_id)
+    
+    def _sync_tag_ids(self, tag_id) -> np.ndarray:
+        return single_flight.do('manychat.tag_sync', tag_id, self._pull_tag_ids, tag_id)
+    
+    def _pull_tag_ids(self, tag_id) -> np.ndarray:
+        # A known set is topped up from its last full page on, read again in
+        # case the listing shifted. findByTag does not document its order:
+        # when it lists more subscribers than are known, the skipped pages
+        # hold new ones too and are read back to front until none are left.
+        now = time.time()
+        state = self.tag_store.get(tag_id)
+        if state is None or now - state[1] >= MANYCHAT_TAG_FULL_SYNC_SECONDS:
+            known, full_sync_at, first_page = np.empty(0, dtype=np.int64), now, 1
+        else:
+            known, full_sync_at = state
+            first_page = max(len(known) // MANYCHAT_PAGE_SIZE, 1)
+        
+        pages = list(self._iter_tag_pages(tag_id, first_page))
+        ids = np.union1d(known, _page_ids(pages))
+        listed = (first_page - 1) * MANYCHAT_PAGE_SIZE + sum(len(page) for page in pages)
         
-        for key, tag_name in BF25_TAGS.items():
-            subscribers = self.get_subscribers_by_tag(tag_name)
-            metrics[key] = len(subscribers)
+        page_number = first_page - 1
+        while len(ids) < listed and page_number >= 1:
+            ids = np.union1d(ids, _page_ids([self._fetch_tag_page(tag_id, page_number)]))
+            page_number -= 1
         
-        return metrics
+        self.tag_store.save(tag_id, ids, full_sync_at)
+        return ids
+    
+    @cached('manychat.funnel')
+    def get_funnel(_self, tag_names: tuple) -> list:
+        # Step i reached = subscribers holding tags 0..i; only counts are cached.
+        steps = []
+        reached = None
+        for tag_name in tag_names:
+            ids = _self.get_tag_ids(tag_name)
+            reached = ids if reached is None else np.intersect1d(reached, ids, assume_unique=True)
+            steps.append({'tag': tag_name, 'subscribers': len(ids), 'reached': len(reached)})
+        return steps
+    
+    @cached('manychat.tag_query')
+    def count_subscribers(_self, all_of: tuple = (), any_of: tuple = (), none_of: tuple = ()) -> int:
+        # |(∩ all_of) ∩ (∪ any_of) − (∪ none_of)|
+        selected = None
+        for tag_name in all_of:
+            ids = _self.get_tag_ids(tag_name)
+            selected = ids if selected is None else np.intersect1d(selected, ids, assume_unique=True)
+        if any_of:
+            union = _self._union(any_of)
+            selected = union if selected is None else np.intersect1d(selected, union, assume_unique=True)
+        if selected is None:
+            return 0
+        if none_of:
+            selected = np.setdiff1d(selected, _self._union(none_of), assume_unique=True)
+        return len(selected)
+    
+    def _union(self, tag_names: tuple) -> np.ndarray:
+        ids = np.empty(0, dtype=np.int64)
+        for tag_name in tag_names:
+            ids = np.union1d(ids, self.get_tag_ids(tag_name))
+        return ids
+    
+    def get_bf25_funnels(self) -> dict:
+        funnels = {name: self.get_funnel(tag_names) for name, tag_names in BF25_FUNNELS.items()}
+        funnels['geral_sem_clique'] = self.count_subscribers(
+            all_of=(BF25_TAGS['geral_boas_vindas_recebeu'],),
+            none_of=(BF25_TAGS['geral_boas_vindas_clicou'],)
+        )
+        return funnels
+    
+    def get_bf25_metrics(self) -> dict:
+        counts = self.get_tag_counts(tuple(BF25_TAGS.values()))
+        return {key: counts[tag_name] for key, tag_name in BF25_TAGS.items()}
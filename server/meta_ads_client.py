@@ -1,14 +1,111 @@
+import json
 import os
-import requests
-import streamlit as st
-from datetime import datetime
+import time
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
+
+from campaigns.config import BRT
+from server.cache import cached
+from server.http import UpstreamError, create_session, request
+from server.local_store import InsightsStore
+from server.singleflight import single_flight
 
 META_BASE_URL = "https://graph.facebook.com/v22.0"
+# Graph API ceiling of calls per batch request.
+META_BATCH_LIMIT = 50
+META_PAGE_SIZE = 500
+# Meta restates recent days as late conversions are attributed; days younger
+# than this are pulled again, older ones are final once stored.
+META_RESTATEMENT_DAYS = int(os.environ.get('META_RESTATEMENT_DAYS', '7'))
+# The recent days are pulled again at most this often, however many
+# ranges are asked for.
+META_DAILY_RESYNC_SECONDS = 300
+META_INSIGHT_FIELDS = 'impressions,clicks,inline_link_clicks,spend,actions'
+
+
+def slim_insight(row: dict) -> dict:
+    return {
+        'day': row.get('date_start'),
+        'impressions': int(row.get('impressions', 0)),
+        'clicks': int(row.get('clicks', 0)),
+        'inline_link_clicks': int(row.get('inline_link_clicks', 0)),
+        'spend': float(row.get('spend', 0)),
+        'actions': [
+            {'action_type': action.get('action_type'), 'value': action.get('value')}
+            for action in row.get('actions') or []
+        ]
+    }
+
+
+def summarize_insights(days: list) -> dict:
+    # Totals and ratios of a range in the shape of an aggregate insights row.
+    if not days:
+        return {}
+    
+    impressions = sum(day['impressions'] for day in days)
+    clicks = sum(day['clicks'] for day in days)
+    link_clicks = sum(day['inline_link_clicks'] for day in days)
+    spend = sum(day['spend'] for day in days)
+    actions = {}
+    for day in days:
+        for action in day['actions']:
+            actions[action['action_type']] = actions.get(action['action_type'], 0) + float(action['value'] or 0)
+    
+    return {
+        'date_start': days[0]['day'],
+        'date_stop': days[-1]['day'],
+        'impressions': impressions,
+        'clicks': clicks,
+        'inline_link_clicks': link_clicks,
+        'spend': round(spend, 2),
+        'actions': [{'action_type': action_type, 'value': value} for action_type, value in actions.items()],
+        'inline_link_click_ctr': link_clicks / impressions * 100 if impressions else 0,
+        'cpc': spend / clicks if clicks else 0,
+        'cpm': spend / impressions * 1000 if impressions else 0
+    }
+
+
+def desafio0326_campaign_filter() -> str:
+    return os.environ.get('META_CAMPAIGN_NAME_DESAFIO0326', 'DESAFIO_IA_MAR26')
+
+
+def _daily_params(campaign_filter: str, since: date, until: date) -> dict:
+    params = {
+        'fields': META_INSIGHT_FIELDS,
+        'time_range': f'{{"since":"{since.strftime("%Y-%m-%d")}","until":"{until.strftime("%Y-%m-%d")}"}}',
+        'time_increment': 1,
+        'limit': META_PAGE_SIZE
+    }
+    
+    if campaign_filter:
+        params['filtering'] = f'[{{"field":"campaign.name","operator":"CONTAIN","value":"{campaign_filter}"}}]'
+    return params
+
+
+def _day_ranges(since: date, until: date, state: tuple, today: date, resync: bool) -> list:
+    # Ranges of [since, until] to pull, given the contiguous range already
+    # stored. Each one touches the stored range, which stays contiguous.
+    if state is None:
+        return [(since, until)]
+    
+    synced_from = date.fromisoformat(state[0])
+    synced_until = date.fromisoformat(state[1])
+    final_until = min(synced_until, today - timedelta(days=META_RESTATEMENT_DAYS)) if resync else synced_until
+    
+    ranges = []
+    if since < synced_from:
+        ranges.append((since, synced_from - timedelta(days=1)))
+    if until > final_until:
+        ranges.append((final_until + timedelta(days=1), until))
+    return ranges
+
 
 class MetaAdsClient:
     def __init__(self):
         self.access_token = os.environ.get('META_ACCESS_TOKEN', '')
         self.ad_account_id = os.environ.get('META_AD_ACCOUNT_ID', '')
+        self.session = create_session()
+        self.insights_store = InsightsStore()
     
     def _make_request(self, endpoint: str, params: dict = None) -> dict:
         if not self.access_token or not self.ad_account_id:
@@ -16,48 +113,140 @@ class MetaAdsClient:
         
         url = f"{META_BASE_URL}/{endpoint}"
         
-        if params is None:
-            params = {}
-        
+        params = dict(params or {})
+        # Identical in-flight reads from concurrent sessions share one request.
+        key = (endpoint, tuple(sorted(params.items())))
+        return single_flight.do('meta_ads.request', key, self._get, url, params)
+    
+    def _get(self, url: str, params: dict) -> dict:
         params['access_token'] = self.access_token
         
-        try:
-            response = requests.get(url, params=params)
-            if response.status_code == 200:
-                return response.json()
-        except Exception as e:
-            st.error(f"Erro Meta Ads: {e}")
+        response = request(self.session, 'meta_ads', 'GET', url, params=params)
+        if response.status_code != 200:
+            raise UpstreamError('meta_ads', f"HTTP {response.status_code}")
+        return response.json()
+    
+    def _make_batch(self, calls: list) -> list:
+        # calls: [(endpoint, params)]. Answers come back in call order, one
+        # round trip per META_BATCH_LIMIT calls.
+        if not self.access_token or not self.ad_account_id:
+            return [{} for _ in calls]
+        if len(calls) == 1:
+            return [self._make_request(*calls[0])]
         
-        return {}
+        results = []
+        for start in range(0, len(calls), META_BATCH_LIMIT):
+            chunk = calls[start:start + META_BATCH_LIMIT]
+            batch = [
+                {'method': 'GET', 'relative_url': f"{endpoint}?{urlencode(params or {})}"}
+                for endpoint, params in chunk
+            ]
+            response = request(
+                self.session, 'meta_ads', 'POST', f"{META_BASE_URL}/",
+                data={'access_token': self.access_token, 'batch': json.dumps(batch), 'include_headers': 'false'}
+            )
+            if response.status_code != 200:
+                raise UpstreamError('meta_ads', f"batch: HTTP {response.status_code}")
+            
+            for (endpoint, params), answer in zip(chunk, response.json()):
+                # Calls the batch timed out on come back as null; retry them alone.
+                if answer is None:
+                    results.append(self._make_request(endpoint, params))
+                elif answer.get('code') != 200:
+                    raise UpstreamError('meta_ads', f"batch {endpoint}: HTTP {answer.get('code')}")
+                else:
+                    results.append(json.loads(answer.get('body') or '{}'))
+        return results
+    
+    def _iter_pages(self, endpoint: str, params: dict = None, first_page: dict = None):
+        # Yields the rows of each page, following the after cursor while the
+        # response still links a next page.
+        params = dict(params or {})
+        page = first_page if first_page is not None else self._make_request(endpoint, params)
+        while True:
+            yield page.get('data', [])
+            
+            paging = page.get('paging', {})
+            after = paging.get('cursors', {}).get('after')
+            if not paging.get('next') or not after:
+                return
+            params['after'] = after
+            page = self._make_request(endpoint, params)
     
-    @st.cache_data(ttl=300, show_spinner=False)
+    @cached('meta_ads.account_info')
     def get_account_info(_self) -> dict:
         return _self._make_request(f"act_{_self.ad_account_id}")
     
-    @st.cache_data(ttl=300, show_spinner=False)
-    def get_insights(_self, start_date: datetime, end_date: datetime, 
-                    campaign_filter: str = None) -> dict:
-        params = {
-            'fields': 'impressions,clicks,inline_link_clicks,spend,actions,inline_link_click_ctr,cpc,cpm',
-            'time_range': f'{{"since":"{start_date.strftime("%Y-%m-%d")}","until":"{end_date.strftime("%Y-%m-%d")}"}}'
-        }
+    def get_insights(self, start_date: datetime, end_date: datetime,
+                     campaign_filter: str = None) -> dict:
+        # Totals of any range are added up from the local daily rows.
+        days = self.get_daily_insights(start_date, end_date, campaign_filter)
+        return {'data': [summarize_insights(days)] if days else []}
+    
+    def get_daily_insights(self, start_date: datetime, end_date: datetime,
+                           campaign_filter: str = None) -> list:
+        # The Graph API only takes whole days, so the key is the day range.
+        return self._fetch_daily_insights(start_date.date(), end_date.date(), campaign_filter)
+    
+    @cached('meta_ads.daily_insights')
+    def _fetch_daily_insights(_self, since: date, until: date, campaign_filter: str = None) -> list:
+        if not _self.access_token or not _self.ad_account_id:
+            return []
+        
+        key = (campaign_filter or '', since, until)
+        single_flight.do('meta_ads.daily_sync', key, _self._sync_daily, *key)
+        return _self.insights_store.load(campaign_filter or '', since.isoformat(), until.isoformat())
+    
+    def _sync_daily(self, campaign_filter: str, since: date, until: date):
+        now = time.time()
+        today = datetime.now(BRT).date()
+        until = min(until, today)
+        if since > until:
+            return
         
-        if campaign_filter:
-            params['filtering'] = f'[{{"field":"campaign.name","operator":"CONTAIN","value":"{campaign_filter}"}}]'
+        state = self.insights_store.get_state(campaign_filter)
+        ranges = _day_ranges(since, until, state, today, state is None or now - state[2] >= META_DAILY_RESYNC_SECONDS)
+        if not ranges:
+            return
         
-        return _self._make_request(f"act_{_self.ad_account_id}/insights", params)
+        # A backfill and a refresh of the recent days go out as one batch.
+        endpoint = f"act_{self.ad_account_id}/insights"
+        calls = [(endpoint, _daily_params(campaign_filter, range_since, range_until)) for range_since, range_until in ranges]
+        rows = []
+        for (_, params), first_page in zip(calls, self._make_batch(calls)):
+            for page in self._iter_pages(endpoint, params, first_page):
+                rows.extend(slim_insight(row) for row in page)
+        
+        synced_from, synced_until, synced_at = since.isoformat(), until.isoformat(), now
+        if state:
+            # synced_at tracks the last pull of the recent days only.
+            recent = any(range_until > today - timedelta(days=META_RESTATEMENT_DAYS) for _, range_until in ranges)
+            synced_from = min(synced_from, state[0])
+            synced_until = max(synced_until, state[1])
+            synced_at = now if recent else state[2]
+        
+        self.insights_store.save(
+            campaign_filter,
+            [(range_since.isoformat(), range_until.isoformat()) for range_since, range_until in ranges],
+            rows, synced_from, synced_until, synced_at
+        )
     
-    @st.cache_data(ttl=300, show_spinner=False)
+    @cached('meta_ads.campaigns')
     def get_campaigns(_self, name_filter: str = None) -> list:
+        return list(_self.iter_campaigns(name_filter))
+    
+    def iter_campaigns(self, name_filter: str = None):
+        # Streams every campaign of the account, page by page.
         params = {
-            'fields': 'name,status,objective,spend'
+            'fields': 'name,status,objective,spend',
+            'limit': META_PAGE_SIZE
         }
         
         if name_filter:
             params['filtering'] = f'[{{"field":"name","operator":"CONTAIN","value":"{name_filter}"}}]'
         
-        result = _self._make_request(f"act_{_self.ad_account_id}/campaigns", params)
-        return result.get('data', [])
+        for page in self._iter_pages(f"act_{self.ad_account_id}/campaigns", params):
+            yield from page
     
     def get_bf25_metrics(self, start_date: datetime, end_date: datetime) -> dict:
         insights = self.get_insights(start_date, end_date, 'BF25')
@@ -76,10 +265,12 @@ class MetaAdsClient:
         return {}
 
     def get_desafio0326_metrics(self, start_date: datetime, end_date: datetime) -> dict:
-        campaign_filter = os.environ.get('META_CAMPAIGN_NAME_DESAFIO0326', 'DESAFIO_IA_MAR26')
-        insights = self.get_insights(start_date, end_date, campaign_filter)
+        insights = self.get_insights(start_date, end_date, desafio0326_campaign_filter())
 
         data = insights.get('data', [{}])
         if data:
             return data[0]
         return {}
+
+    def get_desafio0326_daily(self, start_date: datetime, end_date: datetime) -> list:
+        return self.get_daily_insights(start_date, end_date, desafio0326_campaign_filter())
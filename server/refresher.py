@@ -0,0 +1,239 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from campaigns.config import CAMPAIGNS, BRT, get_campaign_product_ids, get_campaign_status
+from server.cache import refreshing
+from server.hotmart_client import APPROVED_STATUSES, REFUND_STATUSES
+from server.snapshots import snapshot_store
+
+REFRESH_ENABLED = os.environ.get('DASHBOARD_BACKGROUND_REFRESH', '1') != '0'
+# Seconds between refreshes of an active campaign, per integration.
+REFRESH_INTERVALS = {
+    'hotmart': int(os.environ.get('REFRESH_INTERVAL_HOTMART_SECONDS', '120')),
+    'google_sheets': int(os.environ.get('REFRESH_INTERVAL_GOOGLE_SHEETS_SECONDS', '180')),
+    'manychat': int(os.environ.get('REFRESH_INTERVAL_MANYCHAT_SECONDS', '300')),
+    'meta_ads': int(os.environ.get('REFRESH_INTERVAL_META_ADS_SECONDS', '900'))
+}
+# Ended campaigns barely change; 0 stops refreshing them at all.
+REFRESH_ENDED_INTERVAL_SECONDS = int(os.environ.get('REFRESH_ENDED_INTERVAL_SECONDS', '21600'))
+REFRESH_TICK_SECONDS = 5
+# Days after period_end before a campaign is frozen into a snapshot bundle,
+# leaving time for late refunds and chargebacks to land (Hotmart refund
+# statuses are walked over the whole campaign on every refresh).
+SNAPSHOT_GRACE_DAYS = int(os.environ.get('SNAPSHOT_GRACE_DAYS', '30'))
+# Only series keyed by a campaign's own date window or spreadsheet are frozen,
+# per integration; ManyChat tags and Meta account data are shared with every
+# other campaign, so they are neither pulled for nor stored in a bundle.
+SNAPSHOT_NAMESPACES = {
+    'hotmart': ('hotmart.sales_history',),
+    'google_sheets': ('google_sheets.',),
+    'meta_ads': ('meta_ads.daily_insights',)
+}
+SNAPSHOT_RETRY_SECONDS = 3600
+
+# Published values outlive a few missed refreshes, then viewers fall back to
+# fetching on their own.
+PUBLISH_MAX_AGE_FACTOR = 3
+
+SHEETS_CLIENTS = {
+    'bf25': 'sheets',
+    'imersao0126': 'imersao_sheets',
+    'desafio0326': 'desafio_sheets'
+}
+
+META_METRICS = {
+    'bf25': 'get_bf25_metrics',
+    'imersao0126': 'get_imersao_metrics',
+    'desafio0326': 'get_desafio0326_metrics'
+}
+
+
+def _campaign_window(campaign: dict) -> tuple:
+    # Same range the dashboards ask for, so the published keys match theirs.
+    return campaign['period_start'], min(campaign['period_end'], datetime.now(BRT))
+
+
+# Warmers return False when the integration is not configured.
+def _warm_hotmart(clients: dict, campaign: dict) -> bool:
+    client = clients['hotmart']
+    if not client.basic_token:
+        return False
+
+    start_date, end_date = _campaign_window(campaign)
+    statuses = APPROVED_STATUSES + REFUND_STATUSES
+    if 'product_id' in campaign['hotmart']:
+        client.get_sales_by_status(campaign['hotmart']['product_id'], start_date, end_date, statuses)
+    else:
+        client.get_sales_by_product(get_campaign_product_ids(campaign['id']), start_date, end_date, statuses)
+    return True
+
+
+def _warm_google_sheets(clients: dict, campaign: dict) -> bool:
+    client = clients.get(SHEETS_CLIENTS.get(campaign['id']))
+    if client is None or not client.spreadsheet_id or not client.connector_hostname:
+        return False
+
+    client.get_row_counts()
+    client.get_sheets()
+    return True
+
+
+def _warm_manychat(clients: dict, campaign: dict) -> bool:
+    client = clients['manychat']
+    if not client.api_token:
+        return False
+
+    client.get_bf25_metrics()
+    client.get_bf25_funnels()
+    return True
+
+
+def _warm_meta_ads(clients: dict, campaign: dict) -> bool:
+    client = clients['meta_ads']
+    method = META_METRICS.get(campaign['id'])
+    if not method or not client.access_token or not client.ad_account_id:
+        return False
+
+    getattr(client, method)(*_campaign_window(campaign))
+    return True
+
+
+WARMERS = {
+    'hotmart': _warm_hotmart,
+    'google_sheets': _warm_google_sheets,
+    'manychat': _warm_manychat,
+    'meta_ads': _warm_meta_ads
+}
+
+
+class Refresher:
+    def __init__(self, clients: dict):
+        self.clients = clients
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._status = {}
+        self._threads = []
+
+    def start(self):
+        # One worker per integration: a slow Meta call never delays Hotmart.
+        for integration in WARMERS:
+            thread = threading.Thread(
+                target=self._run, args=(integration,), name=f'refresher-{integration}', daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+        thread = threading.Thread(target=self._run_snapshots, name='refresher-snapshots', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+
+    def _interval(self, campaign: dict, integration: str) -> int:
+        if not campaign.get('integrations', {}).get(integration) or snapshot_store.is_frozen(campaign['id']):
+            return 0
+
+        status, _ = get_campaign_status(campaign)
+        if status == 'active':
+            return REFRESH_INTERVALS[integration]
+        if status == 'ended':
+            return REFRESH_ENDED_INTERVAL_SECONDS
+        return 0
+
+    def _run(self, integration: str):
+        next_run = {}
+
+        while not self._stop.is_set():
+            for campaign_id, campaign in CAMPAIGNS.items():
+                interval = self._interval(campaign, integration)
+                if interval <= 0 or time.monotonic() < next_run.get(campaign_id, 0):
+                    continue
+
+                self._refresh(campaign, integration, interval)
+                next_run[campaign_id] = time.monotonic() + interval
+
+            self._stop.wait(REFRESH_TICK_SECONDS)
+
+    def _refresh(self, campaign: dict, integration: str, interval: int):
+        started = time.time()
+        error = None
+
+        try:
+            with refreshing(interval * PUBLISH_MAX_AGE_FACTOR):
+                WARMERS[integration](self.clients, campaign)
+        except Exception as e:
+            error = str(e)
+
+        with self._lock:
+            self._status[(campaign['id'], integration)] = {
+                'finished_at': time.time(),
+                'duration': time.time() - started,
+                'error': error
+            }
+
+    def _freeze_due(self, campaign: dict) -> bool:
+        status, _ = get_campaign_status(campaign)
+        if status != 'ended' or snapshot_store.is_frozen(campaign['id']):
+            return False
+        return datetime.now(BRT) > campaign['period_end'] + timedelta(days=SNAPSHOT_GRACE_DAYS)
+
+    def _run_snapshots(self):
+        failed_at = {}
+
+        while not self._stop.is_set():
+            for campaign_id, campaign in CAMPAIGNS.items():
+                if not self._freeze_due(campaign):
+                    continue
+                if campaign_id in failed_at and time.monotonic() - failed_at[campaign_id] < SNAPSHOT_RETRY_SECONDS:
+                    continue
+                if not self.freeze(campaign):
+                    failed_at[campaign_id] = time.monotonic()
+
+            self._stop.wait(REFRESH_TICK_SECONDS)
+
+    def freeze(self, campaign: dict) -> bool:
+        # Pull every snapshotted source of the campaign once, bypassing the
+        # caches, and write them as an immutable bundle. All or nothing: one of
+        # them that fails or is not configured leaves the campaign unfrozen.
+        started = time.time()
+        error = None
+
+        try:
+            integrations = [
+                integration for integration in SNAPSHOT_NAMESPACES
+                if campaign.get('integrations', {}).get(integration)
+            ]
+            with refreshing() as values:
+                for integration in integrations:
+                    if not WARMERS[integration](self.clients, campaign):
+                        raise RuntimeError(f"{integration} não configurado")
+
+            prefixes = tuple(prefix for integration in integrations for prefix in SNAPSHOT_NAMESPACES[integration])
+            values = {
+                (namespace, key): value for (namespace, key), value in values.items()
+                if namespace.startswith(prefixes)
+            }
+            written = snapshot_store.freeze(campaign['id'], values, {
+                'name': campaign['name'],
+                'period_start': campaign['period_start'],
+                'period_end': campaign['period_end']
+            })
+            if not written and not snapshot_store.is_frozen(campaign['id']):
+                raise RuntimeError("snapshot não gravado")
+        except Exception as e:
+            error = str(e)
+
+        with self._lock:
+            self._status[(campaign['id'], 'snapshot')] = {
+                'finished_at': time.time(),
+                'duration': time.time() - started,
+                'error': error
+            }
+        return error is None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {key: dict(values) for key, values in sorted(self._status.items())}
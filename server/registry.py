@@ -0,0 +1,55 @@
+import streamlit as st
+
+from server.google_sheet_client import GoogleSheetClient, ImersaoSheetClient, DesafioSheetClient
+from server.hotmart_client import HotmartClient
+from server.manychat_client import ManyChatClient
+from server.meta_ads_client import MetaAdsClient
+from server.refresher import REFRESH_ENABLED, Refresher
+
+# One client per integration for the whole process, shared by every
+# browser session: a single OAuth token, connection pool and local store.
+
+
+@st.cache_resource(show_spinner=False)
+def get_hotmart_client() -> HotmartClient:
+    return HotmartClient()
+
+
+@st.cache_resource(show_spinner=False)
+def get_manychat_client() -> ManyChatClient:
+    return ManyChatClient()
+
+
+@st.cache_resource(show_spinner=False)
+def get_meta_ads_client() -> MetaAdsClient:
+    return MetaAdsClient()
+
+
+@st.cache_resource(show_spinner=False)
+def get_sheets_client() -> GoogleSheetClient:
+    return GoogleSheetClient()
+
+
+@st.cache_resource(show_spinner=False)
+def get_imersao_sheets_client() -> ImersaoSheetClient:
+    return ImersaoSheetClient()
+
+
+@st.cache_resource(show_spinner=False)
+def get_desafio_sheets_client() -> DesafioSheetClient:
+    return DesafioSheetClient()
+
+
+@st.cache_resource(show_spinner=False)
+def get_refresher() -> Refresher:
+    refresher = Refresher({
+        'hotmart': get_hotmart_client(),
+        'manychat': get_manychat_client(),
+        'meta_ads': get_meta_ads_client(),
+        'sheets': get_sheets_client(),
+        'imersao_sheets': get_imersao_sheets_client(),
+        'desafio_sheets': get_desafio_sheets_client()
+    })
+    if REFRESH_ENABLED:
+        refresher.start()
+    return refresher
@@ -0,0 +1,75 @@
+import functools
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._counters = {}
+
+    def do(self, namespace: str, key, func, *args, **kwargs):
+        # The first caller for (namespace, key) runs func; callers arriving
+        # while it is in flight wait for it and share its result or error.
+        flight_key = (namespace, key)
+        with self._lock:
+            counters = self._counters.setdefault(namespace, {'calls': 0, 'absorbed': 0})
+            counters['calls'] += 1
+            call = self._calls.get(flight_key)
+            leader = call is None
+            if leader:
+                call = self._calls[flight_key] = _Call()
+            else:
+                counters['absorbed'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[flight_key]
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {namespace: dict(values) for namespace, values in sorted(self._counters.items())}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+single_flight = SingleFlight()
+
+
+def coalesced(namespace: str):
+    # Keys on the call arguments (self included), so they must be hashable.
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            return single_flight.do(namespace, key, func, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
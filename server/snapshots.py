@@ -0,0 +1,199 @@
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import date, datetime
+
+import pyarrow as pa
+
+from server.local_store import DATA_DIR
+
+SNAPSHOTS_DIR = os.path.join(DATA_DIR, 'snapshots')
+MANIFEST_FILE = 'manifest.json'
+# Version 1 bundles also froze campaign-independent series (ManyChat tags);
+# they are ignored and replaced when those campaigns get frozen again.
+MANIFEST_VERSION = 2
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} não é serializável")
+
+
+def key_token(namespace: str, key: tuple) -> str:
+    # Series keys hold datetimes and tuples; the token is their stable text form.
+    return json.dumps([namespace, key], default=_json_default, ensure_ascii=False)
+
+
+def _is_row_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(row, list) for row in value)
+
+
+def _is_record_list(value) -> bool:
+    # Flat dicts sharing one set of keys, like the slim Hotmart sales; Arrow
+    # would fill missing keys with None and alter anything else.
+    if not isinstance(value, list) or not value or not isinstance(value[0], dict):
+        return False
+    keys = value[0].keys()
+    return all(
+        isinstance(row, dict) and row.keys() == keys
+        and not any(isinstance(cell, (dict, list)) for cell in row.values())
+        for row in value
+    )
+
+
+def _manifest_version(directory: str):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f).get('version')
+
+
+def _write_arrow(path: str, table: pa.Table):
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _write_entry(directory: str, index: int, value) -> dict:
+    # Tabular values go to Arrow IPC files (memory-mapped on load); anything
+    # else is small and stays in JSON.
+    if _is_record_list(value):
+        try:
+            filename = f"{index:04d}.arrow"
+            _write_arrow(os.path.join(directory, filename), pa.Table.from_pylist(value))
+            return {'file': filename, 'format': 'records'}
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            pass
+    elif _is_row_list(value):
+        filename = f"{index:04d}.arrow"
+        rows = pa.array([[str(cell) for cell in row] for row in value], type=pa.list_(pa.string()))
+        _write_arrow(os.path.join(directory, filename), pa.table({'row': rows}))
+        return {'file': filename, 'format': 'rows'}
+
+    filename = f"{index:04d}.json"
+    with open(os.path.join(directory, filename), 'w', encoding='utf-8') as f:
+        json.dump(value, f, default=_json_default, ensure_ascii=False)
+    return {'file': filename, 'format': 'json'}
+
+
+class SnapshotStore:
+    # Immutable per-campaign bundles under SNAPSHOTS_DIR/<campaign_id>: one file
+    # per cached call plus a manifest mapping series keys to files.
+    def __init__(self, root: str = SNAPSHOTS_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+        self._entries = None
+        self._manifests = {}
+        self._tables = {}
+
+    def _load(self):
+        entries = {}
+        manifests = {}
+        if os.path.isdir(self.root):
+            for campaign_id in sorted(os.listdir(self.root)):
+                if '.tmp-' in campaign_id or '.old-' in campaign_id:
+                    continue
+                path = os.path.join(self.root, campaign_id, MANIFEST_FILE)
+                if _manifest_version(os.path.dirname(path)) != MANIFEST_VERSION:
+                    continue
+                with open(path, encoding='utf-8') as f:
+                    manifest = json.load(f)
+                manifests[campaign_id] = manifest
+                for entry in manifest['entries']:
+                    entries[entry['token']] = (os.path.join(self.root, campaign_id, entry['file']), entry['format'])
+        self._entries = entries
+        self._manifests = manifests
+        self._tables = {}
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._entries is None:
+                self._load()
+
+    def is_frozen(self, campaign_id: str) -> bool:
+        self._ensure_loaded()
+        return campaign_id in self._manifests
+
+    def manifests(self) -> dict:
+        self._ensure_loaded()
+        return dict(self._manifests)
+
+    def _table(self, path: str) -> pa.Table:
+        # Arrow files are mapped once and kept open: the table's buffers point
+        # into the mapping, so the bundle lives in the page cache, not the heap.
+        with self._lock:
+            table = self._tables.get(path)
+        if table is None:
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+            with self._lock:
+                self._tables[path] = table
+        return table
+
+    def get(self, namespace: str, key: tuple) -> tuple:
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            entry = self._entries.get(key_token(namespace, key))
+        if entry is None:
+            return False, None
+
+        # Every reader gets its own Python copy, like st.cache_data entries.
+        path, file_format = entry
+        if file_format == 'json':
+            with open(path, encoding='utf-8') as f:
+                return True, json.load(f)
+        if file_format == 'rows':
+            return True, self._table(path).column('row').to_pylist()
+        return True, self._table(path).to_pylist()
+
+    def freeze(self, campaign_id: str, values: dict, metadata: dict = None) -> bool:
+        # values: {(namespace, key): value}. Written to a temporary directory
+        # and renamed into place, so readers never see a partial bundle.
+        # Returns False when a current bundle was already there.
+        final_dir = os.path.join(self.root, campaign_id)
+        tmp_dir = f"{final_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        entries = []
+        for index, ((namespace, key), value) in enumerate(sorted(values.items(), key=lambda item: key_token(*item[0]))):
+            entry = _write_entry(tmp_dir, index, value)
+            entry['namespace'] = namespace
+            entry['token'] = key_token(namespace, key)
+            entries.append(entry)
+
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'campaign_id': campaign_id,
+            'frozen_at': time.time(),
+            'metadata': metadata or {},
+            'entries': entries
+        }
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, default=_json_default, ensure_ascii=False, indent=2)
+
+        for filename in os.listdir(tmp_dir):
+            os.chmod(os.path.join(tmp_dir, filename), 0o444)
+
+        old_dir = None
+        with self._lock:
+            if os.path.exists(final_dir):
+                if _manifest_version(final_dir) == MANIFEST_VERSION:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    return False
+                # Bundle of an older format (or a partial one): moved aside
+                # and replaced, since _load skips it.
+                old_dir = f"{final_dir}.old-{os.getpid()}-{threading.get_ident()}"
+                os.rename(final_dir, old_dir)
+            os.rename(tmp_dir, final_dir)
+            self._entries = None
+
+        if old_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+        return True
+
+
+snapshot_store = SnapshotStore()
@@ -70,6 +70,59 @@ def create_pie_chart(labels: list, values: list, colors: list = None) -> go.Figu
     
     return fig
 
+def create_meta_trend_chart(df: pd.DataFrame, primary_color: str = '#F94E03',
+                            secondary_color: str = '#FB7B3D') -> go.Figure:
+    if df.empty:
+        return go.Figure()
+    
+    fig = go.Figure()
+    
+    fig.add_trace(go.Bar(
+        x=df['day'],
+        y=df['spend'],
+        name='Gasto (R$)',
+        marker_color=primary_color
+    ))
+    
+    fig.add_trace(go.Scatter(
+        x=df['day'],
+        y=df['inline_link_clicks'],
+        mode='lines+markers',
+        name='Cliques no link',
+        line=dict(color=secondary_color, width=3),
+        yaxis='y2'
+    ))
+    
+    fig.update_layout(
+        title='Meta Ads por Dia',
+        xaxis_title='Data',
+        yaxis=dict(title='Gasto (R$)'),
+        yaxis2=dict(title='Cliques no link', overlaying='y', side='right'),
+        template='plotly_white',
+        font=dict(family='Montserrat'),
+        hovermode='x unified'
+    )
+    
+    return fig
+
+def create_funnel_chart(labels: list, values: list, title: str, primary_color: str = '#F94E03') -> go.Figure:
+    fig = go.Figure()
+    
+    fig.add_trace(go.Funnel(
+        y=labels,
+        x=values,
+        textinfo='value+percent previous',
+        marker=dict(color=primary_color)
+    ))
+    
+    fig.update_layout(
+        title=title,
+        template='plotly_white',
+        font=dict(family='Montserrat')
+    )
+    
+    return fig
+
 def create_dark_theme_chart(fig: go.Figure) -> go.Figure:
     fig.update_layout(
         paper_bgcolor='rgba(0,0,0,0)',
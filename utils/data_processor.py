@@ -1,38 +1,58 @@
 import pandas as pd
-from datetime import datetime
 from zoneinfo import ZoneInfo
 
 BRT = ZoneInfo('America/Sao_Paulo')
 
-def process_hotmart_sales(sales: list) -> pd.DataFrame:
+SALE_RECORD_COLUMNS = ['transaction_id', 'order_date', 'status', 'value', 'buyer_email', 'buyer_name', 'offer_code']
+
+def process_hotmart_sales(sales: list, include_buyer: bool = True) -> pd.DataFrame:
     if not sales:
         return pd.DataFrame()
     
-    processed = []
-    for sale in sales:
-        purchase = sale.get('purchase', {})
-        buyer = sale.get('buyer', {})
-        
-        order_date_ms = purchase.get('order_date', 0)
-        order_date = datetime.fromtimestamp(order_date_ms / 1000, tz=BRT) if order_date_ms else None
-        
-        processed.append({
-            'transaction_id': purchase.get('transaction'),
-            'order_date': order_date,
-            'status': purchase.get('status'),
-            'value': purchase.get('hotmart_fee', {}).get('base', 0),
-            'buyer_email': buyer.get('email'),
-            'buyer_name': buyer.get('name'),
-            'offer_code': purchase.get('offer', {}).get('code')
-        })
+    # Sales arrive as flat slim records (hotmart_client.slim_sale), so the
+    # frame is built column-wise with one vectorized timestamp conversion.
+    records = pd.DataFrame.from_records(sales, columns=SALE_RECORD_COLUMNS)
+    
+    order_date_ms = records['order_date'].astype('float64')
+    order_date = pd.to_datetime(order_date_ms.where(order_date_ms != 0), unit='ms', utc=True).dt.tz_convert(BRT)
+    
+    columns = {
+        'transaction_id': records['transaction_id'],
+        'order_date': order_date,
+        'status': records['status'].astype('category'),
+        'value': records['value']
+    }
+    
+    if include_buyer:
+        columns['buyer_email'] = records['buyer_email']
+        columns['buyer_name'] = records['buyer_name']
+    else:
+        # Tabs that only aggregate keep a 64-bit key per buyer instead of the
+        # strings; buyers without an email get no key rather than one shared hash.
+        emails = records['buyer_email']
+        keys = pd.Series(pd.util.hash_array(emails.fillna('').to_numpy(dtype=object)), dtype='UInt64')
+        columns['buyer_key'] = keys.mask(emails.isna() | (emails == ''))
     
-    df = pd.DataFrame(processed)
+    columns['offer_code'] = records['offer_code'].astype('category')
     
-    if 'order_date' in df.columns and not df.empty:
+    df = pd.DataFrame(columns)
+    df['value'] = df['value'].astype('float64')
+    
+    if not df.empty:
         df = df.sort_values('order_date', ascending=False)
     
     return df
 
+def frame_memory_report(frames: dict) -> pd.DataFrame:
+    rows = []
+    for name, df in frames.items():
+        rows.append({
+            'dataset': name,
+            'rows': len(df),
+            'bytes': int(df.memory_usage(deep=True).sum()) if not df.empty else 0
+        })
+    return pd.DataFrame(rows, columns=['dataset', 'rows', 'bytes'])
+
 def calculate_sales_metrics(df: pd.DataFrame) -> dict:
     if df.empty:
         return {
@@ -47,14 +67,102 @@ def calculate_sales_metrics(df: pd.DataFrame) -> dict:
         'average_ticket': df['value'].mean()
     }
 
+# Formats the Sheets API returns for pt-BR spreadsheets (FORMATTED_VALUE).
+SHEET_DATE_FORMATS = ('%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d')
+# 1.234,56 / 1234,56 / 12; longer digit runs are ids or phones, not numbers.
+SHEET_CURRENCY_PREFIX = r'^R\$\s*'
+SHEET_NUMBER_PATTERN = r'-?(?:\d{1,3}(?:\.\d{3})+|\d{1,9})(?:,\d+)?'
+# CEPs and codes such as 001 lose their leading zeros as numbers; any cell
+# like that keeps the column as text.
+SHEET_LEADING_ZERO_PATTERN = r'^-?0\d'
+SHEET_EMAIL_PATTERN = r'[^@\s]+@[^@\s]+\.[^@\s]+'
+SHEET_PHONE_PATTERN = r'\+?[\d\s().-]+'
+SHEET_PHONE_DIGITS = (10, 13)
+# Text columns with few distinct answers (survey options, origins) become
+# categoricals once the sheet is large enough for it to matter.
+SHEET_CATEGORY_MIN_ROWS = 1000
+SHEET_CATEGORY_MAX_RATIO = 0.5
+# Cells checked before a type is tried on the whole column.
+SHEET_SAMPLE_SIZE = 200
+
+def _sheet_columns(header: list, width: int) -> list:
+    # Blank and repeated titles get unique names, as do cells past the header.
+    names = []
+    seen = {}
+    for index in range(width):
+        name = str(header[index]).strip() if index < len(header) else ''
+        name = name or f"Coluna {index + 1}"
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        names.append(f"{name} ({count + 1})" if count else name)
+    return names
+
+def _all_match(values: pd.Series, pattern: str) -> bool:
+    # The sample rejects most columns without scanning them.
+    return bool(values.head(SHEET_SAMPLE_SIZE).str.fullmatch(pattern).all() and values.str.fullmatch(pattern).all())
+
+def _type_sheet_values(values: pd.Series) -> pd.Series:
+    # Decides the type of a whole column at once: every filled cell has to
+    # parse, otherwise the column stays text.
+    filled = values.dropna()
+    if filled.empty:
+        return values
+    
+    if _all_match(filled, SHEET_EMAIL_PATTERN):
+        return values.str.lower()
+    
+    sample_digits = filled.head(SHEET_SAMPLE_SIZE).str.replace(r'\D', '', regex=True).str.len()
+    if sample_digits.between(*SHEET_PHONE_DIGITS).all() and _all_match(filled, SHEET_PHONE_PATTERN):
+        digits = values.str.replace(r'\D', '', regex=True)
+        if digits.dropna().str.len().between(*SHEET_PHONE_DIGITS).all():
+            return digits
+    
+    sample = filled.head(SHEET_SAMPLE_SIZE).str.replace(SHEET_CURRENCY_PREFIX, '', regex=True)
+    amounts = values.str.replace(SHEET_CURRENCY_PREFIX, '', regex=True) if sample.str.fullmatch(SHEET_NUMBER_PATTERN).all() else None
+    if (amounts is not None and _all_match(amounts.dropna(), SHEET_NUMBER_PATTERN)
+            and not amounts.str.contains(SHEET_LEADING_ZERO_PATTERN).any()):
+        numbers = pd.to_numeric(amounts.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+        return numbers.astype('Float64' if amounts.str.contains(',', regex=False).any() else 'Int64')
+    
+    for date_format in SHEET_DATE_FORMATS:
+        if pd.to_datetime(filled.head(SHEET_SAMPLE_SIZE), format=date_format, errors='coerce').isna().any():
+            continue
+        dates = pd.to_datetime(values, format=date_format, errors='coerce')
+        if dates.notna().sum() == len(filled):
+            # Localized by zone name: the vectorized path, unlike a ZoneInfo object.
+            return dates.dt.tz_localize(BRT.key)
+    
+    return values
+
+def _type_sheet_column(column: pd.Series) -> pd.Series:
+    # Distinct cells are parsed once and mapped back through their codes;
+    # padded cells (code -1) come back as missing values.
+    codes, uniques = pd.factorize(column)
+    values = pd.Series(uniques, dtype='string').str.strip()
+    typed = _type_sheet_values(values.mask(values == ''))
+    result = pd.Series(typed.array.take(codes, allow_fill=True), index=column.index, name=column.name)
+    
+    filled = int((codes >= 0).sum())
+    if (result.dtype == 'string' and filled >= SHEET_CATEGORY_MIN_ROWS
+            and len(uniques) <= filled * SHEET_CATEGORY_MAX_RATIO):
+        return result.astype('category')
+    return result
+
 def process_sheets_data(data: list, has_header: bool = True) -> pd.DataFrame:
     if not data:
         return pd.DataFrame()
     
-    if has_header and len(data) > 1:
-        return pd.DataFrame(data[1:], columns=data[0])
+    header = data[0] if has_header else []
+    rows = data[1:] if has_header else data
+    width = max(len(header), max(map(len, rows), default=0))
+    
+    # The values API drops trailing empty cells, so rows are ragged; building
+    # the frame from the row lists pads them with None in one pass.
+    df = pd.DataFrame(rows).reindex(columns=range(width))
+    if has_header:
+        df.columns = _sheet_columns(header, width)
     
-    return pd.DataFrame(data)
+    return pd.DataFrame({name: _type_sheet_column(df[name]) for name in df.columns}, index=df.index)
 
 def group_sales_by_date(df: pd.DataFrame) -> pd.DataFrame:
     if df.empty or 'order_date' not in df.columns: